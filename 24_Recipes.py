@@ -303,6 +303,42 @@ print("="*40)
 # so when converting from "dictionaries" to "shelve", make sure to watch for extra commas and brackets that may cause errors
 
 
+# Nested keys without one big dictionary
+
+# books["recipes"]["soup"] above unpickles ALL the recipes just to give us soup, and changing one recipe
+# means writing all of them back. shelf_nested stores every recipe as its own record ("recipes/soup"),
+# so we only read or write the one we want (see shelf_nested.py)
+
+import shelf_log
+
+with shelf_log.open("book2") as books2:
+    recipes = books2.sub("recipes")
+    recipes["blt"] = ["bacon", "lettuce", "tomato", "bread"]
+    recipes["soup"] = ["tin of soup"]
+    recipes["pasta"] = ["pasta", "cheese"]
+    books2.sub("maintenance")["loose"] = ["gaffer tape"]
+
+    print(recipes["soup"])                      # reads only "recipes/soup"
+    print(sorted(recipes))                      # the recipe names
+
+print("="*40)
+
+
+# Which recipes use bread?
+
+# Without help we would have to unpickle every recipe and look inside. shelf_index keeps an index of the
+# ingredients up to date on every assignment, so the question is one lookup (see shelf_index.py)
+
+import shelf_index
+
+with shelf_index.open("recipes", indexes={"ingredient": shelf_index.list_items}) as recipes:
+    print(recipes.lookup("ingredient", "bread"))          # ['beans_on_toast', 'blt']
+    for snack, ingredients in recipes.find("ingredient", "butter"):
+        print(snack, ingredients)
+
+print("="*40)
+
+
 # "shelve" challenge
 
 # Switching dictionary to shelve and vice versa
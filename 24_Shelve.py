@@ -347,6 +347,31 @@ print("="*40)
 
 
 
+# The problem with above is that list(fruit.keys()) reads ALL the keys into memory and then sorts them
+# before we can print the first one. With millions of keys that takes a long time and a lot of memory.
+# A shelf_log shelf opened with sorted_index=True keeps its keys sorted on disk (ShelfTest2.sidx),
+# so ordered_keys gives them in alphabetical order straight away. It can also give a range or a prefix
+# ======================================================================
+
+import shelf_log
+
+with shelf_log.open("ShelfTest2", sorted_index=True) as fruit:
+    fruit["orange"] = "Orange is a sweet citrus fruit"
+    fruit["apple"] = "Apple is a red crunchy fruit"
+    fruit["lemon"] = "Lemon is a sour yellow citrus fruit"
+    fruit["grape"] = "Grapes grow in bunches"
+    fruit["lime"] = "Lime is a sour green citrus fruit"
+
+    for f in fruit.ordered_keys():  # already in alphabetical order, no list and no sort
+        print(f + " - " + fruit[f])
+
+    print(list(fruit.ordered_keys("g", "m")))      # keys between "g" and "m": grape, lemon, lime
+    print(list(fruit.ordered_keys(prefix="l")))    # keys starting with "l": lemon, lime
+
+print("="*40)
+
+
+
 
 # ======================================================================
 # "values" and "items" methods in "shelve
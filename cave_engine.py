@@ -0,0 +1,202 @@
+# ================
+# cave_engine.py
+# ================
+
+# The cave game without input() and print()
+
+# cave_game.py reads every command with input() and prints the result, so it can only be played
+# by a person at a keyboard. CaveEngine runs the same rules on commands we give it:
+#   - a command is upper-cased; if it is longer than one letter, the first word (or abbreviation)
+#     found in the vocabulary is used instead (so "go north" and "go nor" become "N"), see cave_vocab
+#   - the direction is looked up in the merged exits of the current location (cave_graph)
+#   - reaching location '0' ends the game, later commands are ignored
+# Each session only needs its current location (loc); the locations shelf, the compiled vocabulary and
+# the graph are shared by all sessions.
+
+# This lets us replay recorded commands for many sessions at once, for regression tests and
+# for measuring how many turns per second a machine can handle:
+#
+#   import cave_engine
+#   engine = cave_engine.CaveEngine.open()               # uses locations.* and vocabulary.*
+#   loc, transcript = engine.play(["north", "w", "quit"])
+#
+#   results = cave_engine.run_batch({"s1": ["n", "q"], "s2": ["w"]}, processes=4)
+#
+# From the command line, with a file of "session<TAB>command" lines:
+#
+#   python cave_engine.py recorded_commands.txt --processes 8
+#
+# --stats FILE plays everything in this process with an instrumented locations shelf (see shelf_stats.py)
+# and writes where the time went (file reads, unpickling, ...) to FILE as JSON.
+
+import argparse
+import io
+import multiprocessing
+from collections import OrderedDict
+
+import cave_graph
+import cave_vocab
+import shelf_frozen
+import shelf_stats
+
+__all__ = ["CaveEngine", "read_sessions", "run_sessions", "run_batch"]
+
+START = '1'   # every session starts on the Road, like cave_game.py
+EXIT = '0'
+
+
+class CaveEngine:
+
+    # vocabulary can be a compiled cave_vocab.Vocabulary or any mapping (e.g. the vocabulary shelf),
+    # which is compiled here
+
+    def __init__(self, locations, vocabulary, graph=None):
+        self.locations = locations
+        if not isinstance(vocabulary, cave_vocab.Vocabulary):
+            vocabulary = cave_vocab.compile_vocabulary(vocabulary)
+        self.vocabulary = vocabulary
+        self.graph = graph if graph is not None else cave_graph.compile_graph(locations)
+
+    @classmethod
+    def open(cls, locations="locations", vocabulary="vocabulary"):
+        # Open the frozen locations shelf (read only, memory-mapped), compiled vocabulary and graph
+        # written by cave_initialize.py
+
+        return cls(shelf_frozen.open(locations), cave_vocab.load(vocabulary), cave_graph.load(locations))
+
+    def close(self):
+        self.locations.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def describe(self, loc):
+        location = self.locations[loc]
+        return ["You are in position: {}".format(loc),
+                "Desc of your location: {}".format(location["desc"]),
+                "availableExits = {}".format(", ".join(location["exits"].keys()))]
+
+    def parse(self, command):
+        # Turn what the player typed into a direction, the same way cave_game.py does
+
+        return self.vocabulary.resolve(command)
+
+    def turn(self, loc, command):
+        # Play one command from "loc". Returns (new loc, lines the game would print)
+
+        target = self.graph.move(self.graph.node(loc), self.parse(command))
+        if target < 0:
+            return loc, ["You cannot go in that direction"]
+        loc = self.graph.name(target)
+        return loc, self.describe(loc)
+
+    def play(self, commands, start=START, transcript=True):
+        # Play a whole session. Returns (final loc, transcript); transcript is None if not wanted
+
+        loc = start
+        lines = self.describe(loc) if transcript else None
+        for command in commands:
+            if loc == EXIT:
+                break
+            loc, output = self.turn(loc, command)
+            if transcript:
+                lines.append("> " + command)
+                lines.extend(output)
+        return loc, lines
+
+
+def read_sessions(lines):
+    # Group "session<TAB>command" lines (a file name or an iterable of lines) by session, keeping order
+
+    if isinstance(lines, str):
+        with io.open(lines, encoding="utf-8") as f:
+            return read_sessions(f)
+    sessions = OrderedDict()
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line:
+            continue
+        session, _, command = line.partition("\t")
+        sessions.setdefault(session, []).append(command)
+    return sessions
+
+
+def run_sessions(engine, sessions, start=START, transcript=True):
+    # Play every session with one engine. sessions maps session id -> commands.
+    # Returns an OrderedDict: session id -> (final loc, transcript)
+
+    return OrderedDict((session, engine.play(commands, start, transcript))
+                       for session, commands in sessions.items())
+
+
+# Process pool version. Every worker process opens the shelves once (they are memory-mapped, so the
+# workers share the same pages) and then plays chunks of sessions
+
+_worker_engine = None
+
+
+def _init_worker(locations, vocabulary):
+    global _worker_engine
+    _worker_engine = CaveEngine.open(locations, vocabulary)
+
+
+def _play_chunk(args):
+    chunk, start, transcript = args
+    return [(session, _worker_engine.play(commands, start, transcript)) for session, commands in chunk]
+
+
+def run_batch(sessions, locations="locations", vocabulary="vocabulary", processes=None,
+              chunk_size=1000, start=START, transcript=True):
+    # Like run_sessions, but spread over a pool of processes. processes=1 plays in this process
+
+    if isinstance(sessions, dict):
+        sessions = sessions.items()
+    if processes == 1:
+        with CaveEngine.open(locations, vocabulary) as engine:
+            return run_sessions(engine, OrderedDict(sessions), start, transcript)
+
+    def chunks():
+        chunk = []
+        for item in sessions:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield chunk, start, transcript
+                chunk = []
+        if chunk:
+            yield chunk, start, transcript
+
+    results = OrderedDict()
+    with multiprocessing.Pool(processes, _init_worker, (locations, vocabulary)) as pool:
+        for played in pool.imap(_play_chunk, chunks()):
+            results.update(played)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded cave game commands")
+    parser.add_argument("commands", help="file of session<TAB>command lines")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--transcript", action="store_true", help="print every session's transcript")
+    parser.add_argument("--stats", metavar="FILE", help="measure the locations shelf and write the numbers to FILE")
+    args = parser.parse_args(argv)
+
+    if args.stats:
+        locations = shelf_stats.InstrumentedShelf(shelf_frozen.FrozenDB("locations"))
+        with CaveEngine(locations, cave_vocab.load("vocabulary"), cave_graph.load("locations")) as engine:
+            results = run_sessions(engine, read_sessions(args.commands), transcript=args.transcript)
+            locations.stats.dump(args.stats)
+            print(locations.stats.report())
+    else:
+        results = run_batch(read_sessions(args.commands), processes=args.processes, transcript=args.transcript)
+    for session, (loc, lines) in results.items():
+        print("{}\t{}".format(session, loc))
+        if lines:
+            for line in lines:
+                print("    " + line)
+
+
+if __name__ == "__main__":
+    main()
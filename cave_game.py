@@ -19,14 +19,34 @@
 # Then use "join(locations[loc]["exits"].keys())" to extract the "values" of "exits" key
 
 
-# We import shelve because we will be using shelves
+# We import shelf_frozen because cave_initialize.py also saves the locations as a frozen file (locations.frz)
 
-import shelve
+import sys
 
-# We then open the shelves (locations & vocabulary) created by cave_initialize.py
+import cave_graph
+import cave_vocab
+import shelf_frozen
 
-locations = shelve.open("locations")
-vocabulary = shelve.open("vocabulary")
+# All the files below are made by cave_initialize.py (they are not in the repository), so run it first
+
+try:
+    # We then open the locations shelf created by cave_initialize.py
+    # The game never changes it, so we open the frozen copy (read only, memory-mapped, nothing loaded at startup).
+    # locations[loc] is one hash lookup in the mapped file, and the pages are shared by every running game
+
+    locations = shelf_frozen.open("locations")
+
+    # The vocabulary is loaded once from vocabulary.voc, which cave_initialize.py compiled from the vocabulary shelf.
+    # It knows every word and its abbreviations ("NOR" for "NORTH"), so we don't touch the shelf while playing
+
+    vocabulary = cave_vocab.load("vocabulary")
+
+    # cave_initialize.py also saved the merged exits of every location as a graph (locations.nav)
+    # so we don't need to copy "exits" and update it with "namedExits" every turn
+
+    graph = cave_graph.load("locations")
+except FileNotFoundError as missing:
+    sys.exit("{} not found: run cave_initialize.py first".format(missing.filename))
 
 loc = '1'  # This was initially an integer, but we convert it to a string (since shelve keys use strings)
 
@@ -40,10 +60,8 @@ while True:
     if loc == '0':    # We also convert this test to string. from 0 to '0'
         break
     else:
-        allExits = locations[loc]["exits"].copy() # pull exits from locations using key "loc" and "exits"
-        print("allExits before update: {}".format(allExits)) # AllExits before being added with namedExits
-        allExits.update(locations[loc]["namedExits"]) # combine "exits" and "namedExits"
-        print("allExits after update: {}".format(allExits)) # allExits after update
+        node = graph.node(loc)  # the number of this location in the graph ("exits" and "namedExits" already combined)
+        print("allExits: {}".format(dict(graph.exits(node))))  # only for printing. Moving below does not need it
 
     # we choose a direction and assign it to variable named "direction"
     direction = input("Enter Direction: "+ availableExits +" : ").upper() # Enter exit. it converts to uppercase to match keys
@@ -55,22 +73,19 @@ while True:
     if len(direction) > 1: # if user entered more than one letter, check vocabulary dictionary
         words = direction.split()  # We take input in "direction", split it by space, then assign it to variable "words"
         print("split words are: {}".format(words)) # We print words here just to see what it has. Not necessary for the code
-        for word in words: # loop through all the entries in "words"
-            if word in vocabulary: # if any of entries in "words" match key in vocabulary
-                direction = vocabulary[word] # retrieve the "value" corresponding to "key" in vocabulary and assign it to direction
-                break # Then we break from the "if word in words"
+        direction = vocabulary.resolve(direction) # first word (or abbreviation) found in vocabulary gives the direction
 
     # Then we use the new "direction" here as normal. so if user typed "QUIT", above code assigns "Q" to direction
     # Then in below code, direction will be "Q" and it will run as normal
 
-    if direction in allExits: # here we test for "allExits"
-        loc = allExits[direction]  # new loc is given value in combined dictionary "allExits"
+    target = graph.move(node, direction)  # where "direction" leads from here, -1 if there is no such exit
+    if target >= 0:
+        loc = graph.name(target)  # new loc is the location key of the target node
         print("New position = : {}: Description = : {}".format(loc, locations[loc]))
     else:
         print("You cannot go in that direction")
 
 
-# Make sure to close the shelves (locations & vocabulary) since we are not using "with"
+# Make sure to close the locations shelf since we are not using "with"
 
-vocabulary.close()
 locations.close()
@@ -0,0 +1,152 @@
+# ===============
+# cave_graph.py
+# ===============
+
+# Precompiled navigation graph for the cave game
+
+# Every turn cave_game.py used to do:
+#   allExits = locations[loc]["exits"].copy()
+#   allExits.update(locations[loc]["namedExits"])
+# i.e. build a brand new dictionary just to find out where a direction leads.
+# The locations never change while the game runs, so we can do that merge once, when the world is
+# initialized, and store the result as plain integer arrays (an adjacency list in "CSR" layout):
+
+#   every location gets a number (its node), every direction ("N", "Q", "2", ...) gets a number (its code)
+#   offsets[node] .. offsets[node + 1]  is the slice of the edge arrays that belongs to that node
+#   directions[edge]                    is the direction code of the edge
+#   targets[edge]                       is the node you end up in
+
+# Moving is then a scan of a few integers (a location only has a handful of exits), with no dict copy
+# or merge. The first plain_counts[node] edges of a node are its "exits" (the ones the game lists),
+# the rest come from "namedExits".
+
+# cave_initialize.py compiles locations.nav next to the locations shelf:
+#
+#   import cave_graph
+#   cave_graph.compile_graph(locations).save("locations")
+#
+# and cave_game.py loads it:
+#
+#   graph = cave_graph.load("locations")
+#   node = graph.node('1')
+#   node = graph.move(node, "W")        # -1 if you cannot go that way
+#   print(graph.name(node))             # '2'
+
+import io
+import json
+import struct
+import sys
+from array import array
+
+__all__ = ["NavGraph", "compile_graph", "load"]
+
+NAV_MAGIC = b"CAVENAV1"
+_HEADER = struct.Struct("<8sI")   # magic, length of the JSON part
+
+
+class NavGraph:
+
+    def __init__(self, names, direction_names, offsets, directions, targets, plain_counts):
+        self.names = names                          # node -> location key
+        self.direction_names = direction_names      # code -> direction string
+        self.offsets = offsets                      # array('I'), len(names) + 1 items
+        self.directions = directions                # array('H'), one per edge
+        self.targets = targets                      # array('I'), one per edge
+        self.plain_counts = plain_counts            # array('H'), how many of a node's edges are "exits"
+        self._nodes = {name: node for node, name in enumerate(names)}
+        self._codes = {direction: code for code, direction in enumerate(direction_names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def node(self, name):
+        return self._nodes[name]
+
+    def name(self, node):
+        return self.names[node]
+
+    def move(self, node, direction):
+        # Node reached by going "direction" from "node", or -1 if there is no such exit
+
+        code = self._codes.get(direction)
+        if code is None:
+            return -1
+        directions = self.directions
+        for edge in range(self.offsets[node], self.offsets[node + 1]):
+            if directions[edge] == code:
+                return self.targets[edge]
+        return -1
+
+    def exits(self, node, named=True):
+        # (direction, location key) pairs of a node, like the merged allExits dictionary.
+        # named=False gives only the "exits" part (what the game shows as available exits)
+
+        start = self.offsets[node]
+        end = self.offsets[node + 1] if named else start + self.plain_counts[node]
+        return [(self.direction_names[self.directions[edge]], self.names[self.targets[edge]])
+                for edge in range(start, end)]
+
+    def save(self, filename):
+        meta = json.dumps({"byteorder": sys.byteorder, "names": self.names,
+                           "directions": self.direction_names}).encode("utf-8")
+        with io.open(filename + ".nav", "wb") as f:
+            f.write(_HEADER.pack(NAV_MAGIC, len(meta)))
+            f.write(meta)
+            for table in (self.offsets, self.plain_counts, self.directions, self.targets):
+                table.tofile(f)
+
+
+def compile_graph(locations):
+    # Build a NavGraph from a locations mapping (a shelf or a dict) shaped like the one in cave_initialize.py
+
+    names = sorted(locations.keys(), key=lambda name: (len(name), name))
+    nodes = {name: node for node, name in enumerate(names)}
+    direction_names = []
+    codes = {}
+    offsets = array("I", [0])
+    directions = array("H")
+    targets = array("I")
+    plain_counts = array("H")
+
+    for name in names:
+        location = locations[name]
+        merged = dict(location["exits"])
+        merged.update(location["namedExits"])
+        for direction, target in merged.items():
+            if direction not in codes:
+                codes[direction] = len(direction_names)
+                direction_names.append(direction)
+            directions.append(codes[direction])
+            targets.append(nodes[target])
+        offsets.append(len(targets))
+        plain_counts.append(len(location["exits"]))
+
+    return NavGraph(names, direction_names, offsets, directions, targets, plain_counts)
+
+
+def load(filename):
+    # Load <filename>.nav written by NavGraph.save
+
+    with io.open(filename + ".nav", "rb") as f:
+        magic, meta_len = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != NAV_MAGIC:
+            raise ValueError("{!r} is not a cave navigation graph".format(filename + ".nav"))
+        meta = json.loads(f.read(meta_len).decode("utf-8"))
+        swap = meta["byteorder"] != sys.byteorder   # file written on a machine with the other byte order
+        node_count = len(meta["names"])
+
+        offsets = array("I")
+        offsets.fromfile(f, node_count + 1)
+        if swap:
+            offsets.byteswap()
+        plain_counts = array("H")
+        plain_counts.fromfile(f, node_count)
+        directions = array("H")
+        directions.fromfile(f, offsets[-1])
+        targets = array("I")
+        targets.fromfile(f, offsets[-1])
+
+    if swap:
+        for table in (plain_counts, directions, targets):
+            table.byteswap()
+    return NavGraph(meta["names"], meta["directions"], offsets, directions, targets, plain_counts)
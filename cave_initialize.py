@@ -1,4 +1,3 @@
-
 # =====================
 # cave_initialize.py
 # =====================
@@ -8,48 +7,66 @@
 # NOTE: shelve keys have to be strings. That is why we convert the numeric values e.g. from 0 to string '0'
 # NOTE: After creating this cave_initialize file, you have to run it so it creates shelves "location" and "vocabularies"
 
-import shelve
+# We use shelf_log instead of shelve. It stores each shelf in append-only locations.log / locations.idx files
+# instead of the dbm.dumb .dat/.dir/.bak files (no 512 byte padding, no rewrite of the whole index on close)
 
-locations = shelve.open("locations")
+# Instead of assigning one key at a time (locations['0'] = ...), we build the data as dictionaries and hand
+# them to shelf_log.load. It creates a new, empty shelf and writes all the values in one sequential pass,
+# which matters once the world has thousands of locations
 
-locations['0'] = {"desc": "This is the exit",
-                  "exits": {},
-                  "namedExits": {}}
+import cave_graph
+import cave_vocab
+import shelf_frozen
+import shelf_log
 
-locations['1'] = {"desc": "This is the Road",
-                  "exits": {"W": '2', "E": '3', "N": '5', "S": '4', "Q": '0'},  # We also convert numerics her to strings
-                  "namedExits": {"2": '2', "3": '3', "5": '5', "4": '4'}}
+locations = {'0': {"desc": "This is the exit",
+                   "exits": {},
+                   "namedExits": {}},
+             '1': {"desc": "This is the Road",
+                   "exits": {"W": '2', "E": '3', "N": '5', "S": '4', "Q": '0'},  # We also convert numerics her to strings
+                   "namedExits": {"2": '2', "3": '3', "5": '5', "4": '4'}},
+             '2': {"desc": "This is the Hill",
+                   "exits": {"N": '5', "Q": '0'},
+                   "namedExits": {"5": '5'}},
+             '3': {"desc": "This is the building",
+                   "exits": {"W": '1', "Q": '0'},
+                   "namedExits": {"1": '1'}},
+             '4': {"desc": "This is the Valley",
+                   "exits": {"N": '1', "W": '2', "Q": '0'},
+                   "namedExits": {"1": '1', "2": '2'}},
+             '5': {"desc": "This is the Forest",
+                   "exits": {"W": '2', "S": '1', "Q": '0'},
+                   "namedExits": {"2": '2', "1": '1'}}
+             }
 
-locations['2'] = {"desc": "This is the Hill",
-                  "exits": {"N": '5', "Q": '0'},
-                  "namedExits": {"5": '5'}}
+vocabulary = {"QUIT": "Q",
+              "NORTH": "N",
+              "SOUTH": "S",
+              "EAST": "E",
+              "WEST": "W",
+              "ROAD": "1",
+              "HILL": "2",
+              "BUILDING": "3",
+              "VALLEY": "4",
+              "FOREST": "5"}
 
-locations['3'] = {"desc": "This is the building",
-                  "exits": {"W": '1', "Q": '0'},
-                  "namedExits": {"1": '1'}}
+# sorted_index=True also writes locations.sidx, the sorted index that open_mapped() maps instead of reading
+# the whole .idx file when it opens the shelf (see shelf_log.py)
 
-locations['4'] = {"desc": "This is the Valley",
-                  "exits": {"N": '1', "W": '2', "Q": '0'},
-                  "namedExits": {"1": '1', "2": '2'}}
+shelf_log.load("locations", locations, sorted_index=True)    # creates locations.log, .idx and .sidx
+shelf_log.load("vocabulary", vocabulary, sorted_index=True)  # creates vocabulary.log, .idx and .sidx
 
-locations['5'] = {"desc": "This is the Forest",
-                  "exits": {"W": '2', "S": '1', "Q": '0'},
-                  "namedExits": {"2": '2', "1": '1'}}
+# The game also needs the merged exits ("exits" + "namedExits") of every location on every turn.
+# We work them out once here and save them as a compact graph (locations.nav) next to the shelf
 
-locations.close()
+cave_graph.compile_graph(locations).save("locations")
 
-vocabulary = shelve.open("vocabulary")
-vocabulary["QUIT"] = "Q"
-vocabulary["NORTH"] = "N"
-vocabulary["SOUTH"] = "S"
-vocabulary["EAST"] = "E"
-vocabulary["WEST"] = "W"
-vocabulary["ROAD"] = "1"
-vocabulary["HILL"] = "2"
-vocabulary["BUILDING"] = "3"
-vocabulary["VALLEY"] = "4"
-vocabulary["FOREST"] = "5"
+# Same idea for the vocabulary: every word and every unambiguous abbreviation ("NOR" for "NORTH") goes into
+# one lookup table (vocabulary.voc) that the game loads once, instead of two shelf lookups per typed word
 
-vocabulary.close()
+cave_vocab.compile_vocabulary(vocabulary).save("vocabulary")
 
+# The game only ever reads the locations, so we also freeze them into locations.frz: one read-only file with
+# a perfect hash table, which every game process maps instead of loading its own index (see shelf_frozen.py)
 
+shelf_frozen.freeze(locations, "locations")
@@ -0,0 +1,108 @@
+# =================
+# cave_loadgen.py
+# =================
+
+# Load generator for cave_server.py
+
+# Opens many game sessions at once against a running cave_server.py, plays random commands in each
+# of them and measures how long every turn takes (from sending the command to reading the whole reply).
+# At the end it prints the turn throughput and the latency percentiles, e.g.
+#
+#   python cave_server.py &
+#   python cave_loadgen.py --sessions 2000 --turns 50 --concurrency 500
+#
+# To get "sessions per core", pin the server to one core (taskset -c 0 python cave_server.py)
+# and raise --concurrency until p99 latency is no longer acceptable.
+
+import argparse
+import asyncio
+import random
+import time
+
+__all__ = ["run", "percentile"]
+
+# Commands a player might type. No "quit", so sessions keep playing for the whole run
+COMMANDS = ["n", "s", "e", "w", "north", "south", "east", "west", "go road", "hill", "building",
+            "valley", "forest", "1", "2", "3", "4", "5", "dance"]
+
+
+async def _read_reply(reader):
+    lines = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None           # server closed the connection
+        line = line.rstrip(b"\n")
+        if not line:
+            return lines
+        lines.append(line)
+
+
+async def _session(host, port, turns, rng, latencies, limit):
+    async with limit:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            if await _read_reply(reader) is None:
+                return
+            for _ in range(turns):
+                command = rng.choice(COMMANDS)
+                start = time.perf_counter()
+                writer.write((command + "\n").encode("utf-8"))
+                await writer.drain()
+                reply = await _read_reply(reader)
+                latencies.append(time.perf_counter() - start)
+                if reply is None:
+                    return
+        finally:
+            writer.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run(host="127.0.0.1", port=8023, sessions=100, turns=20, concurrency=100, seed=0):
+    # Play "sessions" sessions of "turns" turns, at most "concurrency" open at once.
+    # Returns a dict with the counts, the elapsed time and the latency percentiles (in seconds)
+
+    rng = random.Random(seed)
+    latencies = []
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        limit = asyncio.Semaphore(concurrency)
+        started = time.perf_counter()
+        loop.run_until_complete(asyncio.gather(
+            *[_session(host, port, turns, random.Random(rng.random()), latencies, limit)
+              for _ in range(sessions)]))
+        elapsed = time.perf_counter() - started
+    finally:
+        loop.close()
+
+    latencies.sort()
+    return {"sessions": sessions, "turns": len(latencies), "seconds": elapsed,
+            "turns_per_second": len(latencies) / elapsed if elapsed else 0.0,
+            "p50": percentile(latencies, 0.50), "p90": percentile(latencies, 0.90),
+            "p99": percentile(latencies, 0.99), "max": latencies[-1] if latencies else 0.0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator for cave_server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8023)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=100, help="sessions open at the same time")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    result = run(args.host, args.port, args.sessions, args.turns, args.concurrency, args.seed)
+    print("{sessions} sessions, {turns} turns in {seconds:.2f}s = {turns_per_second:.0f} turns/s".format(**result))
+    print("turn latency p50 {:.2f}ms  p90 {:.2f}ms  p99 {:.2f}ms  max {:.2f}ms".format(
+        result["p50"] * 1000, result["p90"] * 1000, result["p99"] * 1000, result["max"] * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# ================
+# cave_server.py
+# ================
+
+# Serve the cave game to many players from one process
+
+# cave_game.py blocks on input(), so every player needs a process of their own.
+# This server uses asyncio instead: one process, one event loop, one CaveEngine (the locations shelf
+# and the vocabulary are opened once, read only), and every connection only keeps its own "loc".
+
+# The protocol is plain lines over TCP (localhost by default), so you can even play with telnet/nc:
+#   - after connecting you get the description of the Road
+#   - send one command per line ("n", "go west", "quit")
+#   - every reply is a few lines followed by an empty line
+#   - the server closes the connection when you reach the exit (location '0')
+
+#   python cave_server.py --port 8023
+#   python cave_loadgen.py --port 8023 --sessions 1000 --turns 50
+
+import argparse
+import asyncio
+
+from cave_engine import CaveEngine, EXIT, START
+
+__all__ = ["serve", "start_server"]
+
+
+def _reply(lines):
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+async def _play(engine, reader, writer):
+    loc = START
+    try:
+        writer.write(_reply(engine.describe(loc)))
+        await writer.drain()
+        while loc != EXIT:
+            line = await reader.readline()
+            if not line:
+                break
+            loc, output = engine.turn(loc, line.decode("utf-8", "replace").strip())
+            writer.write(_reply(output))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def start_server(engine, host="127.0.0.1", port=8023):
+    # Coroutine that starts listening. Every connection plays against the same engine
+
+    return asyncio.start_server(lambda reader, writer: _play(engine, reader, writer), host, port)
+
+
+def serve(host="127.0.0.1", port=8023, locations="locations", vocabulary="vocabulary"):
+    # Run the server until Ctrl+C
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    with CaveEngine.open(locations, vocabulary) as engine:
+        server = loop.run_until_complete(start_server(engine, host, port))
+        print("Serving the cave game on {}:{}".format(host, port))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Line based TCP server for the cave game")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8023)
+    parser.add_argument("--locations", default="locations")
+    parser.add_argument("--vocabulary", default="vocabulary")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.locations, args.vocabulary)
+
+
+if __name__ == "__main__":
+    main()
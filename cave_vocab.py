@@ -0,0 +1,88 @@
+# ===============
+# cave_vocab.py
+# ===============
+
+# The cave game vocabulary compiled into one in-memory lookup table
+
+# cave_game.py splits what the player typed and for every word does
+#   if word in vocabulary:            # shelf lookup 1
+#       direction = vocabulary[word]  # shelf lookup 2
+# so a long command line costs two shelf lookups per word.
+
+# compile_vocabulary reads the vocabulary shelf once and builds a single dictionary holding
+#   - every word ("NORTH" -> "N")
+#   - every abbreviation of at least min_prefix letters ("NOR", "NORT" -> "N"), as long as it is not
+#     ambiguous (if two words with different meanings start with the same letters, that prefix is left out)
+# cave_initialize.py saves it as vocabulary.voc and the game loads it once at startup, so resolving a
+# whole input line is one pass over its words with one dictionary lookup each.
+
+#   import cave_vocab
+#   words = cave_vocab.load("vocabulary")
+#   words.resolve("go nor")     # "N"
+#   words.resolve("w")          # single letters are used as they are: "W"
+
+import io
+import json
+
+__all__ = ["Vocabulary", "compile_vocabulary", "load"]
+
+
+class Vocabulary:
+
+    def __init__(self, table, min_prefix=3):
+        self.table = table            # word or abbreviation -> value
+        self.min_prefix = min_prefix
+
+    def __contains__(self, word):
+        return word in self.table
+
+    def __getitem__(self, word):
+        return self.table[word]
+
+    def __len__(self):
+        return len(self.table)
+
+    def resolve(self, command):
+        # Same rule as cave_game.py: a command longer than one letter is split into words and the
+        # first word (or abbreviation) in the vocabulary decides the direction.
+        # Anything else comes back upper-cased and unchanged
+
+        direction = command.upper()
+        if len(direction) > 1:
+            table = self.table
+            for word in direction.split():
+                value = table.get(word)
+                if value is not None:
+                    return value
+        return direction
+
+    def save(self, filename):
+        with io.open(filename + ".voc", "w", encoding="utf-8") as f:
+            json.dump({"min_prefix": self.min_prefix, "table": self.table}, f, separators=(",", ":"))
+
+
+def compile_vocabulary(vocabulary, min_prefix=3):
+    # Build a Vocabulary from a vocabulary mapping (a shelf or a dict) like the one in cave_initialize.py
+
+    words = {word: vocabulary[word] for word in vocabulary.keys()}
+    prefixes = {}
+    ambiguous = set()     # prefixes shared by words with different meanings
+    for word, value in words.items():
+        for length in range(min_prefix, len(word)):
+            prefix = word[:length]
+            if prefix in ambiguous:
+                continue
+            if prefixes.setdefault(prefix, value) != value:
+                del prefixes[prefix]
+                ambiguous.add(prefix)
+
+    prefixes.update(words)    # a whole word always wins over an abbreviation of another word
+    return Vocabulary(prefixes, min_prefix)
+
+
+def load(filename):
+    # Load <filename>.voc written by Vocabulary.save
+
+    with io.open(filename + ".voc", encoding="utf-8") as f:
+        data = json.load(f)
+    return Vocabulary(data["table"], data["min_prefix"])
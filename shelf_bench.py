@@ -0,0 +1,280 @@
+# ================
+# shelf_bench.py
+# ================
+
+# Benchmarks of the ways this project uses shelves, against any shelf backend
+
+# Every script here uses its shelves in its own way:
+#   point_get         24_Shelve.py:      fruit.get(key, default) for what the user typed (hits and misses)
+#   sorted_iteration  24_Shelve.py:      sort the keys, then read every value in key order
+#   items_scan        24_Shelve.py:      for key, value in fruit.items()
+#   writeback         24_Recipes.py:     writeback=True, recipes[key].append(...), then close (sync)
+#   read_modify_write 24_Recipes.py:     temp_list = recipes[key]; temp_list.append(...); recipes[key] = temp_list
+#   bulk_init         cave_initialize.py: create the shelf and write every key once
+#   hot_read_loop     cave_game.py:      read the same few locations over and over (3 reads per turn)
+# Each of them is a workload here with the same knobs: number of keys, value size, hit ratio (for the
+# lookups), number of operations and a random seed, so a run can be repeated exactly.
+
+# A backend is a function that opens a shelf: (filename, flag, writeback) -> shelf. See BACKENDS.
+# Every operation is timed on its own; the report has the throughput and the p50/p90/p99/max latency.
+# --save keeps the results as JSON and --compare prints how a run differs from a saved one:
+#
+#   python shelf_bench.py --keys 10000 --save before.json
+#   ... change something ...
+#   python shelf_bench.py --keys 10000 --compare before.json
+#
+#   python shelf_bench.py --workloads point_get hot_read_loop --backends dbm.dumb shelf_log --hit-ratio 0.2
+
+import argparse
+import dbm.dumb
+import io
+import json
+import os
+import platform
+import random
+import shelve
+import shutil
+import tempfile
+import time
+
+import shelf_cache
+import shelf_log
+from cave_loadgen import percentile
+
+__all__ = ["BACKENDS", "WORKLOADS", "run", "compare"]
+
+BACKENDS = {
+    "dbm.dumb": lambda filename, flag, writeback: shelve.Shelf(dbm.dumb.open(filename, flag), writeback=writeback),
+    "dbm": lambda filename, flag, writeback: shelve.open(filename, flag, writeback=writeback),
+    "shelf_log": lambda filename, flag, writeback: shelf_log.open(filename, flag, writeback=writeback),
+    "shelf_log+sorted": lambda filename, flag, writeback: shelf_log.open(filename, flag, writeback=writeback,
+                                                                         sorted_index=True),
+    # shelf_cache has no writeback, so that backend always reads through its LRU cache
+    "shelf_cache": lambda filename, flag, writeback: shelf_cache.CachedShelf(dbm.dumb.open(filename, flag)),
+}
+
+
+def _value(rng, size):
+    # A recipe-like list of short strings, about "size" bytes of text
+
+    words = []
+    while sum(len(word) for word in words) < size:
+        words.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(8)))
+    return words
+
+
+def _populate(open_shelf, filename, keys, rng, value_size):
+    with open_shelf(filename, "n", False) as shelf:
+        for key in keys:
+            shelf[key] = _value(rng, value_size)
+
+
+def _timed(latencies, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+# Each workload gets a backend, a file name and the parameters, and returns the latencies of its operations
+
+def _bulk_init(open_shelf, filename, keys, rng, params):
+    latencies = []
+    values = [_value(rng, params["value_size"]) for _ in keys]
+    with open_shelf(filename, "n", False) as shelf:
+        for key, value in zip(keys, values):
+            _timed(latencies, shelf.__setitem__, key, value)
+        _timed(latencies, shelf.close)
+    return latencies
+
+
+def _lookup_keys(keys, rng, params):
+    # What the user typed: an existing key with probability hit_ratio, otherwise a key that isn't there
+
+    for number in range(params["ops"]):
+        if rng.random() < params["hit_ratio"]:
+            yield rng.choice(keys)
+        else:
+            yield "missing-{}".format(number)
+
+
+def _point_get(open_shelf, filename, keys, rng, params):
+    _populate(open_shelf, filename, keys, rng, params["value_size"])
+    latencies = []
+    with open_shelf(filename, "r", False) as shelf:
+        for key in _lookup_keys(keys, rng, params):
+            _timed(latencies, shelf.get, key, "We don't have a " + key)
+    return latencies
+
+
+def _sorted_keys(shelf):
+    if isinstance(shelf, shelf_log.LogShelf):
+        try:
+            return list(shelf.ordered_keys())
+        except shelf_log.error:
+            pass        # no sorted index
+    ordered_keys = list(shelf.keys())
+    ordered_keys.sort()
+    return ordered_keys
+
+
+def _sorted_iteration(open_shelf, filename, keys, rng, params):
+    _populate(open_shelf, filename, keys, rng, params["value_size"])
+    latencies = []
+    with open_shelf(filename, "r", False) as shelf:
+        for key in _timed(latencies, _sorted_keys, shelf):
+            _timed(latencies, shelf.__getitem__, key)
+    return latencies
+
+
+def _items_scan(open_shelf, filename, keys, rng, params):
+    _populate(open_shelf, filename, keys, rng, params["value_size"])
+    latencies = []
+    with open_shelf(filename, "r", False) as shelf:
+        items = iter(shelf.items())
+        while True:
+            start = time.perf_counter()
+            if next(items, None) is None:
+                break
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _writeback(open_shelf, filename, keys, rng, params):
+    _populate(open_shelf, filename, keys, rng, params["value_size"])
+    latencies = []
+    with open_shelf(filename, "w", True) as shelf:
+        for _ in range(params["ops"]):
+            _timed(latencies, lambda key: shelf[key].append("butter"), rng.choice(keys))
+        _timed(latencies, shelf.close)
+    return latencies
+
+
+def _read_modify_write(open_shelf, filename, keys, rng, params):
+    _populate(open_shelf, filename, keys, rng, params["value_size"])
+    latencies = []
+
+    def update(shelf, key):
+        temp_list = shelf[key]
+        temp_list.append("tomato")
+        shelf[key] = temp_list
+
+    with open_shelf(filename, "w", False) as shelf:
+        for _ in range(params["ops"]):
+            _timed(latencies, update, shelf, rng.choice(keys))
+    return latencies
+
+
+def _hot_read_loop(open_shelf, filename, keys, rng, params):
+    _populate(open_shelf, filename, keys, rng, params["value_size"])
+    hot = keys[:params["hot_keys"]]
+    latencies = []
+
+    def turn(shelf, key):
+        # cave_game.py reads locations[loc] for the exits, the description and the named exits
+        shelf[key]
+        shelf[key]
+        shelf[key]
+
+    with open_shelf(filename, "r", False) as shelf:
+        for _ in range(params["ops"]):
+            _timed(latencies, turn, shelf, rng.choice(hot))
+    return latencies
+
+
+WORKLOADS = {
+    "point_get": _point_get,
+    "sorted_iteration": _sorted_iteration,
+    "items_scan": _items_scan,
+    "writeback": _writeback,
+    "read_modify_write": _read_modify_write,
+    "bulk_init": _bulk_init,
+    "hot_read_loop": _hot_read_loop,
+}
+
+DEFAULT_PARAMS = {"keys": 1000, "value_size": 100, "hit_ratio": 0.5, "ops": 5000, "hot_keys": 6, "seed": 0}
+
+
+def run(workloads=None, backends=None, **params):
+    # Run every workload against every backend. Returns a list of results:
+    # {"workload", "backend", "ops", "seconds", "ops_per_sec", "p50_us", "p90_us", "p99_us", "max_us"}
+
+    params = dict(DEFAULT_PARAMS, **params)
+    results = []
+    directory = tempfile.mkdtemp(prefix="shelf_bench-")
+    try:
+        for workload in workloads or list(WORKLOADS):
+            for backend in backends or list(BACKENDS):
+                rng = random.Random(params["seed"])
+                keys = ["key{:08d}".format(number) for number in range(params["keys"])]
+                filename = os.path.join(directory, "{}-{}".format(workload, backend))
+                latencies = WORKLOADS[workload](BACKENDS[backend], filename, keys, rng, params)
+                latencies.sort()
+                seconds = sum(latencies)
+                results.append({"workload": workload, "backend": backend, "ops": len(latencies),
+                                "seconds": seconds,
+                                "ops_per_sec": len(latencies) / seconds if seconds else 0.0,
+                                "p50_us": percentile(latencies, 0.50) * 1e6,
+                                "p90_us": percentile(latencies, 0.90) * 1e6,
+                                "p99_us": percentile(latencies, 0.99) * 1e6,
+                                "max_us": latencies[-1] * 1e6 if latencies else 0.0})
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline):
+    # Lines saying how each result differs from the same workload and backend in baseline
+
+    old = {(result["workload"], result["backend"]): result for result in baseline}
+    lines = []
+    for result in results:
+        before = old.get((result["workload"], result["backend"]))
+        if before is None or not before["ops_per_sec"] or not before["p99_us"]:
+            continue
+        lines.append("{:<18}{:<18}throughput {:+7.1%}   p99 {:+7.1%}".format(
+            result["workload"], result["backend"],
+            result["ops_per_sec"] / before["ops_per_sec"] - 1, result["p99_us"] / before["p99_us"] - 1))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark shelf access patterns")
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), help="default: all")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), help="default: all")
+    parser.add_argument("--keys", type=int, default=DEFAULT_PARAMS["keys"])
+    parser.add_argument("--value-size", type=int, default=DEFAULT_PARAMS["value_size"], help="bytes of text per value")
+    parser.add_argument("--hit-ratio", type=float, default=DEFAULT_PARAMS["hit_ratio"],
+                        help="share of point_get lookups that find their key")
+    parser.add_argument("--ops", type=int, default=DEFAULT_PARAMS["ops"], help="operations per workload")
+    parser.add_argument("--hot-keys", type=int, default=DEFAULT_PARAMS["hot_keys"], help="keys hot_read_loop reads")
+    parser.add_argument("--seed", type=int, default=DEFAULT_PARAMS["seed"])
+    parser.add_argument("--save", metavar="FILE", help="write the results to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare with results saved by --save")
+    args = parser.parse_args(argv)
+
+    params = {"keys": args.keys, "value_size": args.value_size, "hit_ratio": args.hit_ratio, "ops": args.ops,
+              "hot_keys": args.hot_keys, "seed": args.seed}
+    results = run(args.workloads, args.backends, **params)
+
+    print("{:<18}{:<18}{:>8}{:>12}{:>10}{:>10}{:>10}{:>10}".format(
+        "workload", "backend", "ops", "ops/s", "p50 us", "p90 us", "p99 us", "max us"))
+    for result in results:
+        print("{workload:<18}{backend:<18}{ops:>8}{ops_per_sec:>12.0f}{p50_us:>10.1f}{p90_us:>10.1f}"
+              "{p99_us:>10.1f}{max_us:>10.1f}".format(**result))
+
+    if args.compare:
+        with io.open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print()
+        print("compared with {} ({})".format(args.compare, baseline["created"]))
+        for line in compare(results, baseline["results"]):
+            print(line)
+    if args.save:
+        with io.open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+                       "platform": platform.platform(), "params": params, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# ================
+# shelf_bloom.py
+# ================
+
+# A bloom filter next to a shelf, so looking up keys that are not there costs no file access
+
+# 24_Shelve.py asks the user for a fruit and then does
+#   description = fruit.get(shelf_key, "We don't have a " + shelf_key)
+#   if shelf_key2 in fruit: ...
+# Most of what people type is not in the shelf (typos, things we don't sell). With a dbm that keeps its
+# index on disk, every one of those misses still searches the index file.
+
+# A bloom filter is a bit array that answers "is this key in the shelf?" with either "certainly not" or
+# "maybe". Every key sets a few bits (hashes of the key); a key whose bits are not all set was never added.
+# BloomShelf checks it first, so in, get() and shelf[key] on a missing key usually return straight away,
+# and only the "maybe" answers (the keys that are there, and about error_rate of the others) go to the file.
+
+# The filter is saved as <filename>.bloom on sync() and close(), together with the size and modification
+# time of the shelf's files. If those don't match when the shelf is opened again (it was written without
+# the filter, or we crashed before saving), the filter is rebuilt from the keys, so it is never out of date.
+# A bloom filter can't forget a key: deleted keys stay "maybe" until there are many of them, then the
+# filter is rebuilt on the next sync(). It is also rebuilt bigger when more keys than it was made for
+# were added.
+
+#   import shelf_bloom
+#   with shelf_bloom.open("ShelfTest") as fruit:
+#       print(fruit.get("banan", "We don't have a banan"))     # no file access
+#       print(fruit.filtered)                                   # lookups answered by the filter
+#
+# Any dbm-like mapping works, e.g. shelf_bloom.BloomShelf(shelf_log.LogDB("locations"), "locations")
+
+import dbm
+import hashlib
+import io
+import json
+import math
+import os
+import shelve
+import struct
+
+__all__ = ["BloomFilter", "BloomShelf", "file_signature", "open"]
+
+BLOOM_MAGIC = b"SHLFBLM1"
+_HEADER = struct.Struct("<8sI")     # magic, length of the JSON metadata, then the metadata and the bits
+
+# The files a dbm (or shelf_log) shelf called "name" may be made of
+_SHELF_FILES = ("", ".db", ".dir", ".dat", ".pag", ".log", ".idx")
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate=0.01):
+        # Enough bits and hashes for "capacity" keys with about error_rate false "maybe"s
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0       # keys added
+        self.deleted = 0     # keys deleted since (still in the filter)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def save(self, filename, files):
+        meta = json.dumps({"capacity": self.capacity, "error_rate": self.error_rate, "size": self.size,
+                           "hashes": self.hashes, "count": self.count, "deleted": self.deleted,
+                           "files": files}).encode("utf-8")
+        tmp = filename + ".tmp"
+        with io.open(tmp, "wb") as f:
+            f.write(_HEADER.pack(BLOOM_MAGIC, len(meta)))
+            f.write(meta)
+            f.write(self.bits)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        # (filter, the "files" it was saved with), or None if there is no usable file
+
+        try:
+            with io.open(filename, "rb") as f:
+                magic, meta_len = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != BLOOM_MAGIC:
+                    return None
+                meta = json.loads(f.read(meta_len).decode("utf-8"))
+                bits = bytearray(f.read())
+        except (OSError, ValueError, struct.error):
+            return None
+        bloom = cls(meta["capacity"], meta["error_rate"])
+        if bloom.size != meta["size"] or bloom.hashes != meta["hashes"] or len(bits) != len(bloom.bits):
+            return None
+        bloom.bits = bits
+        bloom.count = meta["count"]
+        bloom.deleted = meta["deleted"]
+        return bloom, meta["files"]
+
+
+def file_signature(filename):
+    # Size and modification time of the shelf's files, to tell whether they changed since a file kept next
+    # to the shelf (this filter, shelf_index's .ix) was saved. A list of [extension, size, mtime_ns]
+
+    files = []
+    for extension in _SHELF_FILES:
+        try:
+            stat = os.stat(filename + extension)
+        except OSError:
+            continue
+        files.append([extension, stat.st_size, stat.st_mtime_ns])
+    return files
+
+
+class BloomShelf(shelve.Shelf):
+
+    # filename: the shelf's file name (without extension), used for <filename>.bloom
+
+    def __init__(self, dict, filename, protocol=None, writeback=False, keyencoding="utf-8",
+                 capacity=None, error_rate=0.01):
+        shelve.Shelf.__init__(self, dict, protocol, writeback, keyencoding)
+        self._bloomfile = filename + ".bloom"
+        self._filename = filename
+        self.error_rate = error_rate
+        self.filtered = 0          # lookups the filter answered without the file
+        self._closed = False
+        self._files = file_signature(filename)
+        loaded = BloomFilter.load(self._bloomfile)
+        if loaded is not None and loaded[1] == self._files and (capacity is None or
+                                                                loaded[0].capacity >= capacity):
+            self.bloom = loaded[0]
+            self._changed = False
+        else:
+            self._rebuild(capacity)
+
+    def _rebuild(self, capacity=None):
+        keys = list(self.dict.keys())
+        self.bloom = BloomFilter(max(capacity or 0, 2 * len(keys), 1024), self.error_rate)
+        for key in keys:
+            self.bloom.add(key)
+        self._changed = True
+
+    def _maybe(self, key):
+        if key.encode(self.keyencoding) in self.bloom:
+            return True
+        self.filtered += 1
+        return False
+
+    def __contains__(self, key):
+        return key in self.cache or (self._maybe(key) and shelve.Shelf.__contains__(self, key))
+
+    def get(self, key, default=None):
+        if key not in self.cache and not self._maybe(key):
+            return default
+        return shelve.Shelf.get(self, key, default)
+
+    def __getitem__(self, key):
+        if key not in self.cache and not self._maybe(key):
+            raise KeyError(key)
+        return shelve.Shelf.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        encoded = key.encode(self.keyencoding)
+        if encoded not in self.bloom:
+            self.bloom.add(encoded)
+            self._changed = True
+        shelve.Shelf.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        shelve.Shelf.__delitem__(self, key)
+        self.bloom.deleted += 1
+        self._changed = True
+
+    def _save(self):
+        # Called once the shelf's files are written, so the saved file times are the final ones
+
+        files = file_signature(self._filename)
+        if self._changed or files != self._files:
+            self.bloom.save(self._bloomfile, files)
+            self._changed = False
+            self._files = files
+
+    def sync(self):
+        shelve.Shelf.sync(self)
+        bloom = self.bloom
+        if bloom.count > bloom.capacity or bloom.deleted > bloom.count // 2:
+            self._rebuild(bloom.capacity * 2 if bloom.count > bloom.capacity else None)
+        self._save()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.sync()
+        finally:
+            shelve.Shelf.close(self)
+        self._save()       # closing may have touched the files again (dbm.dumb writes its .dir)
+
+
+def open(filename, flag="c", protocol=None, writeback=False, capacity=None, error_rate=0.01):
+    # Same as shelve.open (same dbm files), with a bloom filter in <filename>.bloom
+
+    return BloomShelf(dbm.open(filename, flag), filename, protocol, writeback,
+                      capacity=capacity, error_rate=error_rate)
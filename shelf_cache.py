@@ -0,0 +1,117 @@
+# ================
+# shelf_cache.py
+# ================
+
+# A shelf that keeps recently read values in memory (already unpickled)
+
+# cave_game.py reads locations[loc] several times per turn and 24_Recipes.py reads recipes[snack] in
+# every loop. A plain shelf unpickles the value again every time.
+# writeback=True keeps values in memory too, but its cache never shrinks and sync() writes every
+# cached entry back to disk whether it changed or not.
+
+# CachedShelf is a read cache:
+#   - it holds decoded values in LRU order and evicts the least recently used ones once
+#     max_entries values or max_bytes pickled bytes are cached (None means no limit on that one)
+#   - assigning or deleting a key drops it from the cache (writes go straight to the file)
+#   - sync() never writes cached values back
+#   - hits, misses and evictions are counted, see cache_info()
+
+# NOTE: a cached value is the same object every time. If you change it in place (append to a list),
+# the change is only in memory, just like a plain shelf without writeback. Assign it back to store it.
+
+# Usage:
+#
+#   import shelf_cache
+#   with shelf_cache.open("recipes", max_entries=100) as recipes:
+#       for snack in recipes:
+#           print(snack, recipes[snack])
+#       print(recipes.cache_info())
+#
+# Any dbm-like mapping works, e.g. shelf_cache.CachedShelf(shelf_log.LogDB("locations"))
+
+import dbm
+import pickle
+import shelve
+from collections import OrderedDict
+from io import BytesIO
+
+__all__ = ["CachedShelf", "open"]
+
+
+class CachedShelf(shelve.Shelf):
+
+    def __init__(self, dict, protocol=None, keyencoding="utf-8", max_entries=1024, max_bytes=None):
+        shelve.Shelf.__init__(self, dict, protocol, False, keyencoding)
+        if max_entries is not None and max_entries < 0:
+            raise ValueError("max_entries must be >= 0 or None")
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError("max_bytes must be >= 0 or None")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lru = OrderedDict()   # key -> (value, pickled size), least recently used first
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, key):
+        try:
+            value, size = self._lru[key]
+        except KeyError:
+            pass
+        else:
+            self._lru.move_to_end(key)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        data = self.dict[key.encode(self.keyencoding)]
+        value = pickle.Unpickler(BytesIO(data)).load()
+        self._remember(key, value, len(data))
+        return value
+
+    def __setitem__(self, key, value):
+        self._forget(key)
+        shelve.Shelf.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._forget(key)
+        shelve.Shelf.__delitem__(self, key)
+
+    def __contains__(self, key):
+        return key in self._lru or key.encode(self.keyencoding) in self.dict
+
+    def _remember(self, key, value, size):
+        if self.max_entries == 0 or (self.max_bytes is not None and size > self.max_bytes):
+            return   # would be evicted straight away
+        self._lru[key] = (value, size)
+        self._cached_bytes += size
+        while ((self.max_entries is not None and len(self._lru) > self.max_entries) or
+               (self.max_bytes is not None and self._cached_bytes > self.max_bytes)):
+            _, (_, old_size) = self._lru.popitem(last=False)
+            self._cached_bytes -= old_size
+            self.evictions += 1
+
+    def _forget(self, key):
+        entry = self._lru.pop(key, None)
+        if entry is not None:
+            self._cached_bytes -= entry[1]
+
+    def cache_clear(self):
+        self._lru.clear()
+        self._cached_bytes = 0
+
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self._lru), "bytes": self._cached_bytes,
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+    def close(self):
+        self.cache_clear()
+        shelve.Shelf.close(self)
+
+
+def open(filename, flag="c", protocol=None, max_entries=1024, max_bytes=None):
+    # Same as shelve.open (same dbm files), but with a bounded read cache instead of writeback
+
+    return CachedShelf(dbm.open(filename, flag), protocol, max_entries=max_entries, max_bytes=max_bytes)
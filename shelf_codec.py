@@ -0,0 +1,431 @@
+# ================
+# shelf_codec.py
+# ================
+
+# Pluggable ways of turning shelf values into bytes and back
+
+# A normal shelf always pickles its values. The values in this project are small and simple:
+# lists of strings (24_Recipes.py), nested dicts of strings (cave_initialize.py), strings and ints
+# (24_Shelve.py). A codec is any object with
+#   name            a short string, recorded in the shelf file header
+#   dumps(value)    -> bytes
+#   loads(data)     -> value (data may be bytes or a memoryview)
+#   config()        -> JSON-able dict, recorded in the header so the file can be read back
+# and shelf_log.open(..., codec=...) uses it instead of pickle (see LogShelf).
+
+# These codecs come with it:
+#   PickleCodec   plain pickle, what shelve always does (and the default)
+#   BinaryCodec   a compact tagged binary format written with the struct module (msgpack-like):
+#                 None/bool/int/float/str/bytes/list/tuple/dict. It is "schema aware": give it the
+#                 key lists your dicts always have, e.g. ("desc", "exits", "namedExits"), and such
+#                 dicts are stored as a schema number plus the values, without repeating the keys.
+#                 Anything it doesn't know (a set, your own class) is pickled on its own inside it.
+#   CompressedCodec wraps one of the others and compresses values of at least "threshold" bytes
+#                 with zlib or lzma. Small values are stored as they are (compressing them would
+#                 only add bytes). With zlib it can use a shared dictionary trained from sample values
+#                 (train_dictionary), so many small, similar values (the recipes!) still compress well.
+
+# Compare them on this project's values with:
+#   python shelf_codec.py
+
+import base64
+import lzma
+import pickle
+import struct
+import timeit
+import zlib
+from collections import Counter
+
+__all__ = ["PickleCodec", "BinaryCodec", "CompressedCodec", "train_dictionary", "from_config", "benchmark"]
+
+
+class PickleCodec:
+
+    name = "pickle"
+
+    def __init__(self, protocol=None):
+        self.protocol = protocol
+
+    def dumps(self, value):
+        return pickle.dumps(value, self.protocol)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+    def config(self):
+        return {"name": self.name}
+
+    @classmethod
+    def from_config(cls, options, protocol=None):
+        return cls(protocol)
+
+
+# BinaryCodec tags. Every value starts with one tag byte
+
+NONE, FALSE, TRUE = 0, 1, 2
+INT8, INT32, INT64, FLOAT = 3, 4, 5, 6
+STR8, STR32, BYTES8, BYTES32 = 7, 8, 9, 10
+LIST8, LIST32, TUPLE8, TUPLE32 = 11, 12, 13, 14
+DICT8, DICT32, SCHEMA = 15, 16, 17
+PICKLED = 18
+
+_B = struct.Struct("<B")
+_I = struct.Struct("<I")
+_i = struct.Struct("<i")
+_q = struct.Struct("<q")
+_d = struct.Struct("<d")
+
+
+class BinaryCodec:
+
+    name = "binary"
+
+    def __init__(self, schemas=()):
+        self.schemas = [tuple(schema) for schema in schemas]
+        if len(self.schemas) > 256:
+            raise ValueError("at most 256 schemas")
+        self._schema_ids = {schema: number for number, schema in enumerate(self.schemas)}
+        self._decoders = {
+            NONE: lambda data, pos: (None, pos),
+            FALSE: lambda data, pos: (False, pos),
+            TRUE: lambda data, pos: (True, pos),
+            INT8: lambda data, pos: (_B.unpack_from(data, pos)[0] - 128, pos + 1),
+            INT32: lambda data, pos: (_i.unpack_from(data, pos)[0], pos + 4),
+            INT64: lambda data, pos: (_q.unpack_from(data, pos)[0], pos + 8),
+            FLOAT: lambda data, pos: (_d.unpack_from(data, pos)[0], pos + 8),
+            STR8: self._str8, STR32: self._str32, BYTES8: self._bytes8, BYTES32: self._bytes32,
+            LIST8: self._list8, LIST32: self._list32, TUPLE8: self._tuple8, TUPLE32: self._tuple32,
+            DICT8: self._dict8, DICT32: self._dict32, SCHEMA: self._schema, PICKLED: self._pickled,
+        }
+
+    def config(self):
+        return {"name": self.name, "schemas": [list(schema) for schema in self.schemas]}
+
+    @classmethod
+    def from_config(cls, options, protocol=None):
+        return cls(options.get("schemas", ()))
+
+    # ----------------------------------------------------------------
+    # encoding
+    # ----------------------------------------------------------------
+
+    def dumps(self, value):
+        out = bytearray()
+        self._encode(value, out)
+        return bytes(out)
+
+    def _encode(self, value, out):
+        kind = type(value)
+        if value is None:
+            out.append(NONE)
+        elif kind is bool:
+            out.append(TRUE if value else FALSE)
+        elif kind is int:
+            if -128 <= value < 128:
+                out.append(INT8)
+                out.append(value + 128)
+            elif -0x80000000 <= value < 0x80000000:
+                out.append(INT32)
+                out += _i.pack(value)
+            elif -0x8000000000000000 <= value < 0x8000000000000000:
+                out.append(INT64)
+                out += _q.pack(value)
+            else:
+                self._encode_pickled(value, out)
+        elif kind is float:
+            out.append(FLOAT)
+            out += _d.pack(value)
+        elif kind is str:
+            self._encode_sized(value.encode("utf-8"), STR8, STR32, out)
+        elif kind is bytes:
+            self._encode_sized(value, BYTES8, BYTES32, out)
+        elif kind is list or kind is tuple:
+            self._encode_count(len(value), LIST8 if kind is list else TUPLE8, out)
+            for item in value:
+                self._encode(item, out)
+        elif kind is dict:
+            schema = self._schema_ids.get(tuple(value)) if self._schema_ids else None
+            if schema is not None:
+                out.append(SCHEMA)
+                out.append(schema)
+                for item in value.values():
+                    self._encode(item, out)
+            else:
+                self._encode_count(len(value), DICT8, out)
+                for key, item in value.items():
+                    self._encode(key, out)
+                    self._encode(item, out)
+        else:
+            self._encode_pickled(value, out)
+
+    @staticmethod
+    def _encode_count(count, tag8, out):
+        # tag8 + 1 is always the 32 bit variant of the same tag
+        if count < 256:
+            out.append(tag8)
+            out.append(count)
+        else:
+            out.append(tag8 + 1)
+            out += _I.pack(count)
+
+    def _encode_sized(self, data, tag8, tag32, out):
+        if len(data) < 256:
+            out.append(tag8)
+            out.append(len(data))
+        else:
+            out.append(tag32)
+            out += _I.pack(len(data))
+        out += data
+
+    def _encode_pickled(self, value, out):
+        data = pickle.dumps(value)
+        out.append(PICKLED)
+        out += _I.pack(len(data))
+        out += data
+
+    # ----------------------------------------------------------------
+    # decoding
+    # ----------------------------------------------------------------
+
+    def loads(self, data):
+        value, pos = self._decode(data, 0)
+        if pos != len(data):
+            raise ValueError("trailing data after the encoded value")
+        return value
+
+    def _decode(self, data, pos):
+        try:
+            decoder = self._decoders[data[pos]]
+        except KeyError:
+            raise ValueError("unknown tag {} at position {}".format(data[pos], pos)) from None
+        return decoder(data, pos + 1)
+
+    @staticmethod
+    def _str8(data, pos):
+        end = pos + 1 + data[pos]
+        return str(data[pos + 1:end], "utf-8"), end
+
+    @staticmethod
+    def _str32(data, pos):
+        end = pos + 4 + _I.unpack_from(data, pos)[0]
+        return str(data[pos + 4:end], "utf-8"), end
+
+    @staticmethod
+    def _bytes8(data, pos):
+        end = pos + 1 + data[pos]
+        return bytes(data[pos + 1:end]), end
+
+    @staticmethod
+    def _bytes32(data, pos):
+        end = pos + 4 + _I.unpack_from(data, pos)[0]
+        return bytes(data[pos + 4:end]), end
+
+    def _items(self, data, pos, count):
+        items = []
+        decode = self._decode
+        for _ in range(count):
+            item, pos = decode(data, pos)
+            items.append(item)
+        return items, pos
+
+    def _list8(self, data, pos):
+        return self._items(data, pos + 1, data[pos])
+
+    def _list32(self, data, pos):
+        return self._items(data, pos + 4, _I.unpack_from(data, pos)[0])
+
+    def _tuple8(self, data, pos):
+        items, pos = self._items(data, pos + 1, data[pos])
+        return tuple(items), pos
+
+    def _tuple32(self, data, pos):
+        items, pos = self._items(data, pos + 4, _I.unpack_from(data, pos)[0])
+        return tuple(items), pos
+
+    def _pairs(self, data, pos, count):
+        result = {}
+        decode = self._decode
+        for _ in range(count):
+            key, pos = decode(data, pos)
+            result[key], pos = decode(data, pos)
+        return result, pos
+
+    def _dict8(self, data, pos):
+        return self._pairs(data, pos + 1, data[pos])
+
+    def _dict32(self, data, pos):
+        return self._pairs(data, pos + 4, _I.unpack_from(data, pos)[0])
+
+    def _schema(self, data, pos):
+        keys = self.schemas[data[pos]]
+        values, pos = self._items(data, pos + 1, len(keys))
+        return dict(zip(keys, values)), pos
+
+    @staticmethod
+    def _pickled(data, pos):
+        end = pos + 4 + _I.unpack_from(data, pos)[0]
+        return pickle.loads(data[pos + 4:end]), end
+
+
+# CompressedCodec puts one byte in front of every value: how the rest of it is stored
+
+STORED, ZLIB, LZMA = 0, 1, 2
+
+
+class CompressedCodec:
+
+    name = "compressed"
+
+    def __init__(self, inner=None, threshold=256, method="zlib", level=6, zdict=None):
+        if method not in ("zlib", "lzma"):
+            raise ValueError("method must be 'zlib' or 'lzma'")
+        if zdict is not None and method != "zlib":
+            raise ValueError("a shared dictionary needs method 'zlib'")
+        self.inner = inner if inner is not None else PickleCodec()
+        self.threshold = threshold
+        self.method = method
+        self.level = level
+        self.zdict = zdict
+        self.stored = 0           # values written as they are (below the threshold, or didn't shrink)
+        self.compressed = 0       # values written compressed
+
+    def dumps(self, value):
+        data = self.inner.dumps(value)
+        if len(data) >= self.threshold:
+            if self.method == "zlib":
+                # raw deflate (negative wbits): no zlib header and checksum, which matter on small values
+                if self.zdict is not None:
+                    compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=self.zdict)
+                else:
+                    compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+                packed = bytes([ZLIB]) + compressor.compress(data) + compressor.flush()
+            else:
+                packed = bytes([LZMA]) + lzma.compress(data, lzma.FORMAT_XZ, lzma.CHECK_NONE, self.level)
+            if len(packed) < len(data) + 1:
+                self.compressed += 1
+                return packed
+        self.stored += 1
+        return bytes([STORED]) + data
+
+    def loads(self, data):
+        method = data[0]
+        if method == STORED:
+            return self.inner.loads(data[1:])
+        if method == ZLIB:
+            if self.zdict is not None:
+                decompressor = zlib.decompressobj(-15, zdict=self.zdict)
+            else:
+                decompressor = zlib.decompressobj(-15)
+            return self.inner.loads(decompressor.decompress(data[1:]) + decompressor.flush())
+        if method == LZMA:
+            return self.inner.loads(lzma.decompress(data[1:]))
+        raise ValueError("unknown compression method {}".format(method))
+
+    def config(self):
+        return {"name": self.name, "inner": self.inner.config(), "threshold": self.threshold,
+                "method": self.method, "level": self.level,
+                "zdict": None if self.zdict is None else base64.b64encode(self.zdict).decode("ascii")}
+
+    @classmethod
+    def from_config(cls, options, protocol=None):
+        zdict = options.get("zdict")
+        return cls(from_config(options["inner"], protocol), options["threshold"], options["method"],
+                   options["level"], None if zdict is None else base64.b64decode(zdict))
+
+
+def train_dictionary(samples, codec=None, size=16384):
+    # Build a zlib shared dictionary from sample values (encoded with codec, default pickle).
+    # zlib finds matches more cheaply near the end of the dictionary, so the most common encoded
+    # samples go last. The dictionary is kept to "size" bytes (zlib uses at most 32KB)
+
+    codec = codec if codec is not None else PickleCodec()
+    counts = Counter(codec.dumps(sample) for sample in samples)
+    zdict = b"".join(data for data, _ in reversed(counts.most_common()))
+    return zdict[-size:]
+
+
+_CODECS = {"pickle": PickleCodec, "binary": BinaryCodec, "compressed": CompressedCodec}
+
+
+def from_config(config, protocol=None):
+    # Rebuild the codec recorded in a shelf header ({"name": ..., ...})
+
+    name = config["name"]
+    if name not in _CODECS:
+        raise ValueError("unknown shelf codec {!r}".format(name))
+    return _CODECS[name].from_config(config, protocol)
+
+
+# ----------------------------------------------------------------
+# benchmark
+# ----------------------------------------------------------------
+
+SAMPLE_VALUES = [
+    "Orange is a sweet citrus fruit",                                       # 24_Shelve.py
+    250,
+    ["bacon", "lettuce", "tomato", "bread"],                                # 24_Recipes.py
+    ["eggs", "butter", "milk"],
+    {"desc": "This is the Road",                                            # cave_initialize.py
+     "exits": {"W": '2', "E": '3', "N": '5', "S": '4', "Q": '0'},
+     "namedExits": {"2": '2', "3": '3', "5": '5', "4": '4'}},
+    {"desc": "This is the Hill", "exits": {"N": '5', "Q": '0'}, "namedExits": {"5": '5'}},
+]
+
+SAMPLE_SCHEMAS = [("desc", "exits", "namedExits")]
+
+# The dictionary is trained on other values of the same shelves: trained on the values it then compresses,
+# it would hold each of them whole, and the "+dict" sizes would say nothing about values written later
+
+TRAINING_VALUES = [
+    "Apple is a red crunchy fruit",                                         # 24_Shelve.py
+    "Lemon is a sour yellow citrus fruit",
+    "Lime is a sour green citrus fruit",
+    ["beans", "bread"],                                                     # 24_Recipes.py
+    ["pasta", "cheese"],
+    ["tin of soup"],
+    {"desc": "This is the building", "exits": {"W": '1', "Q": '0'},          # cave_initialize.py
+     "namedExits": {"1": '1'}},
+    {"desc": "This is the Valley", "exits": {"N": '1', "W": '2', "Q": '0'},
+     "namedExits": {"1": '1', "2": '2'}},
+    {"desc": "This is the Forest", "exits": {"W": '2', "S": '1', "Q": '0'},
+     "namedExits": {"2": '2', "1": '1'}},
+]
+
+
+def benchmark(values=SAMPLE_VALUES, codecs=None, number=20000, training=TRAINING_VALUES):
+    # Encode and decode every value "number" times with each codec.
+    # Returns {codec name: {"bytes": total encoded size, "encode_us": ..., "decode_us": ...}}
+    # (microseconds per value). training: the samples the default "+dict" codec's dictionary is made
+    # from, which should not be the measured values
+
+    if codecs is None:
+        codecs = [PickleCodec(), BinaryCodec(), BinaryCodec(SAMPLE_SCHEMAS),
+                  CompressedCodec(threshold=0),
+                  CompressedCodec(threshold=0, zdict=train_dictionary(training))]
+    results = {}
+    for codec in codecs:
+        label = _label(codec)
+        encoded = [codec.dumps(value) for value in values]
+        for value, data in zip(values, encoded):
+            if codec.loads(data) != value:
+                raise AssertionError("{} did not round trip {!r}".format(label, value))
+        encode = timeit.timeit(lambda: [codec.dumps(value) for value in values], number=number)
+        decode = timeit.timeit(lambda: [codec.loads(data) for data in encoded], number=number)
+        per_value = 1e6 / (number * len(values))
+        results[label] = {"bytes": sum(len(data) for data in encoded),
+                          "encode_us": encode * per_value, "decode_us": decode * per_value}
+    return results
+
+
+def _label(codec):
+    if isinstance(codec, CompressedCodec):
+        return "{}({}{})".format(codec.method, _label(codec.inner), "+dict" if codec.zdict else "")
+    if getattr(codec, "schemas", None):
+        return codec.name + "+schemas"
+    return codec.name
+
+
+if __name__ == "__main__":
+    print("{:<22}{:>8}{:>14}{:>14}".format("codec", "bytes", "encode us", "decode us"))
+    for label, result in benchmark().items():
+        print("{:<22}{bytes:>8}{encode_us:>14.2f}{decode_us:>14.2f}".format(label, **result))
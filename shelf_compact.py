@@ -0,0 +1,144 @@
+# ==================
+# shelf_compact.py
+# ==================
+
+# Give back the space that overwritten and deleted values leave in a shelf's data file
+
+# In 24_Shelve.py, fruit["lime"] = "Great with tequila" writes the longer value at the end of ShelfTest.dat
+# and leaves the old one where it was, and del bike["engin_size"] only removes the key from bike.dir.
+# dbm.dumb never reuses or gives back that space, so a shelf that is updated a lot only ever grows.
+
+# compact() copies the live values into a new data file, one after the other in file order, and then
+# swaps it in for the old one:
+#   - dbm.dumb shelves (.dir/.dat): values keep starting on 512 byte blocks, because dbm.dumb overwrites
+#     a value in place when the new one needs no more blocks than the old one. So the space that comes
+#     back is the dead values (and the blocks they padded), not the padding of the live ones
+#   - shelf_log shelves (.log/.idx): LogDB.compact() does the work (see shelf_log.py)
+# It returns how many bytes that gave back.
+
+# The new .dat file is written next to the old one (<name>.dat.compact) while the shelf keeps working, and
+# the new .dir is written as <name>.dir.compact. Then the .dat and the .dir are replaced, in that order.
+# If we crash between the two, the next compact() finds the .dir.compact file and finishes the swap.
+# dbm.dumb keeps its index in memory, so a shelf another process has open still has the old positions:
+# compact shelves nobody else has open, or reopen them afterwards. A shelf opened in this process can be
+# passed in and keeps working.
+
+#   import shelf_compact
+#   print(shelf_compact.compact("ShelfTest"))   # {'before': 2091, 'after': ..., 'reclaimed': ...}
+#
+# or from the command line, for any number of shelves:
+#
+#   python shelf_compact.py ShelfTest bike bike2
+
+import argparse
+import dbm.dumb
+import io
+import os
+import shelve
+
+import shelf_log
+
+__all__ = ["compact"]
+
+BLOCK_SIZE = 512    # dbm.dumb._BLOCKSIZE
+
+
+def _finish_swap(dirfile):
+    # A .dir.compact left behind means the new .dat file is already in place: put its .dir in place too
+
+    if os.path.exists(dirfile + ".compact") and not os.path.exists(dirfile[:-len(".dir")] + ".dat.compact"):
+        os.replace(dirfile + ".compact", dirfile)
+
+
+def _write_dir(filename, index):
+    # The same format dbm.dumb writes ("%r, %r\n" per key, Latin-1)
+
+    with io.open(filename, "w", encoding="Latin-1") as f:
+        for key, pos_and_size in index.items():
+            f.write("%r, %r\n" % (key.decode("Latin-1"), pos_and_size))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _compact_dumb(db):
+    db._verify_open()
+    if db._readonly:
+        raise dbm.dumb.error("The database is opened for reading only")
+    datfile = os.fsdecode(db._datfile)
+    dirfile = os.fsdecode(db._dirfile)
+    bakfile = os.fsdecode(db._bakfile)
+    before = os.path.getsize(datfile)
+    entries = sorted(db._index.items(), key=lambda item: item[1][0])
+    index = {}
+    pos = 0
+    with io.open(datfile, "rb") as src, io.open(datfile + ".compact", "wb") as dst:
+        for key, (old_pos, size) in entries:
+            src.seek(old_pos)
+            value = src.read(size)
+            padded = (pos + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+            dst.write(b"\0" * (padded - pos))
+            dst.write(value)
+            index[key] = (padded, size)
+            pos = padded + size
+        dst.flush()
+        os.fsync(dst.fileno())
+    _write_dir(dirfile + ".compact", index)
+    for name in (datfile + ".compact", dirfile + ".compact"):
+        try:
+            os.chmod(name, db._mode)
+        except OSError:
+            pass
+
+    os.replace(datfile + ".compact", datfile)
+    os.replace(dirfile + ".compact", dirfile)
+    if os.path.exists(bakfile):
+        _write_dir(bakfile, index)     # an old .bak would point at the old positions
+    db._index = index
+    db._modified = False
+    return before, pos
+
+
+def _compact_log(db):
+    # The size the db knows about, which counts the writes still in its buffer (the file doesn't yet)
+
+    before = db.stats()["file_bytes"]
+    db.compact()
+    return before, db.stats()["file_bytes"]
+
+
+def compact(shelf):
+    # Compact a shelf: a file name (dbm.dumb or shelf_log files), an open shelf, or an open
+    # dbm.dumb / shelf_log database. Returns {"before": bytes, "after": bytes, "reclaimed": bytes}
+
+    if isinstance(shelf, str):
+        if os.path.exists(shelf + ".log"):
+            with shelf_log.open(shelf, "w", autocompact=False) as opened:
+                return compact(opened)
+        _finish_swap(shelf + ".dir")
+        with dbm.dumb.open(shelf, "w") as db:
+            return compact(db)
+
+    db = shelf.dict if isinstance(shelf, shelve.Shelf) else shelf
+    if isinstance(db, shelf_log.LogDB):
+        before, after = _compact_log(db)
+    elif isinstance(db, dbm.dumb._Database):
+        if isinstance(shelf, shelve.Shelf) and shelf.writeback:
+            shelf.sync()       # write the cached values first, so they are compacted too
+        before, after = _compact_dumb(db)
+    else:
+        raise TypeError("can't compact a {} (only dbm.dumb and shelf_log files)".format(type(db).__name__))
+    return {"before": before, "after": after, "reclaimed": before - after}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Give back the unused space in shelf files")
+    parser.add_argument("shelves", nargs="+", help="shelf file names without extension, e.g. ShelfTest")
+    args = parser.parse_args(argv)
+
+    for name in args.shelves:
+        result = compact(name)
+        print("{}: {before} -> {after} bytes, {reclaimed} reclaimed".format(name, **result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+# =================
+# shelf_frozen.py
+# =================
+
+# Frozen shelves: static data compiled into one read-only, memory-mapped file
+
+# The locations and vocabulary shelves made by cave_initialize.py never change while the game runs.
+# A normal shelf still pays for being changeable: an index that has to be read into a dict when the
+# shelf is opened (in every process), and room for dead records, appends and so on.
+
+# freeze() writes the shelf once as <name>.frz, and FrozenShelf reads it:
+#   header   magic, number of keys, number of slots, number of buckets, salt, where the tables are,
+#            length of the JSON metadata (the codec the values are encoded with)
+#   records  key length, value length, key bytes, value bytes       (one per key)
+#   seeds    one 4 byte displacement per bucket
+#   slots    one 8 byte record offset per slot (0: empty)
+#
+# The tables are a perfect hash: every key has a slot of its own, so a lookup is
+#   hash the key (blake2b) -> its bucket -> the bucket's displacement -> its slot -> its record
+# with no probing and no collisions, and then one comparison of the key bytes (a key that is not in the
+# file lands on some other key's slot, or on an empty one). Nothing is read into memory when the file is
+# opened: it is memory-mapped, and the pages a lookup touches come from the page cache, which every
+# process reading the file shares. Values are decoded straight from the mapped bytes and not kept, so a
+# process using a frozen shelf holds almost none of it in its own memory.
+
+# The slots are found when freezing ("hash and displace"): the keys are put into buckets by one part of
+# their hash, and the biggest buckets go first. For each bucket we try displacements 0, 1, 2, ... until
+# every key of the bucket lands on a free slot of its own. There are a few more slots than keys, so
+# the last buckets still find free slots quickly. The number of slots is a prime, so that every step
+# (1 .. slots - 1) visits all slots.
+
+#   import shelf_frozen
+#   shelf_frozen.freeze("locations")          # locations.log/.idx (or dbm files) -> locations.frz
+#   with shelf_frozen.open("locations") as locations:
+#       print(locations['1']["desc"])
+#
+# or from the command line:
+#
+#   python shelf_frozen.py locations vocabulary
+
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import os
+import shelve
+import struct
+from array import array
+
+import shelf_codec
+import shelf_log
+import shelf_scan
+
+__all__ = ["error", "FrozenDB", "FrozenShelf", "freeze", "open"]
+
+error = OSError     # same as dbm.dumb and shelf_log
+
+FROZEN_MAGIC = b"SHLFFRZ1"
+_HEADER = struct.Struct("<8sQQQIQQI")   # magic, keys, slots, buckets, salt, seeds pos, slots pos, meta length
+_RECORD = struct.Struct("<II")          # key length, value length
+_SEED = struct.Struct("<I")
+_SLOT = struct.Struct("<Q")
+
+LOAD_FACTOR = 0.9       # keys per slot
+BUCKET_SIZE = 2         # keys per bucket, on average (more: smaller seed table, slower freeze())
+MAX_DISPLACEMENT = 1 << 20
+
+
+def _is_prime(number):
+    if number < 2:
+        return False
+    divisor = 2
+    while divisor * divisor <= number:
+        if number % divisor == 0:
+            return False
+        divisor += 1
+    return True
+
+
+def _slot_count(keys):
+    slots = max(2, int(keys / LOAD_FACTOR) + 1)
+    while not _is_prime(slots):
+        slots += 1
+    return slots
+
+
+def _hashes(key, salt, slots):
+    # (bucket hash, first slot, slot step) of a key. Displacement d puts it in slot (first + d * step) % slots
+
+    digest = hashlib.blake2b(key, digest_size=24, salt=_SEED.pack(salt)).digest()
+    return (int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:16], "little") % slots,
+            int.from_bytes(digest[16:], "little") % (slots - 1) + 1)
+
+
+def _place(hashes, slots, buckets):
+    # The displacement of every bucket, so that all keys get a slot of their own. None if some bucket
+    # can't be placed (then the caller tries another salt)
+
+    members = [[] for _ in range(buckets)]
+    for h0, h1, h2 in hashes:
+        members[h0 % buckets].append((h1, h2))
+    seeds = array("I", bytes(4 * buckets))
+    taken = bytearray(slots)
+    for bucket in sorted(range(buckets), key=lambda bucket: -len(members[bucket])):
+        keys = members[bucket]
+        if not keys:
+            break
+        for displacement in range(MAX_DISPLACEMENT):
+            positions = {(h1 + displacement * h2) % slots for h1, h2 in keys}
+            if len(positions) == len(keys) and not any(taken[position] for position in positions):
+                break
+        else:
+            return None
+        for position in positions:
+            taken[position] = 1
+        seeds[bucket] = displacement
+    return seeds
+
+
+def _open_source(filename):
+    # A shelf file name opened read only: shelf_log files if there are any, else dbm
+
+    if os.path.exists(filename + ".log"):
+        return shelf_log.open(filename, "r")
+    return shelve.open(filename, "r")
+
+
+def _source_items(source):
+    # (key, value) pairs of an open shelf, or a mapping
+
+    if isinstance(source, shelve.Shelf):
+        yield from shelf_scan.items(source)
+    else:
+        yield from source.items()
+
+
+def freeze(source, filename=None, codec=None):
+    # Write the frozen file <filename>.frz from source: a shelf file name (then filename defaults to it),
+    # an open shelf, or a mapping like the locations dict in cave_initialize.py. The values are encoded with
+    # codec (default: the codec of a shelf_log source, else pickle). Returns the number of keys
+
+    if filename is None:
+        if not isinstance(source, str):
+            raise TypeError("freeze() needs a file name for a source that isn't one")
+        filename = source
+    if isinstance(source, str):
+        with _open_source(source) as shelf:     # opened here, so its codec is known before encoding
+            return freeze(shelf, filename, codec)
+    if codec is None:
+        codec = getattr(source, "codec", None) or shelf_codec.PickleCodec()
+    meta = json.dumps({"codec": codec.config()}, sort_keys=True).encode("utf-8")
+
+    # The records are written as they come, only the keys' hashes and offsets are kept
+
+    tmp = filename + ".frz.tmp"
+    keys = []
+    offsets = []
+    with io.open(tmp, "wb") as f:
+        f.write(_HEADER.pack(FROZEN_MAGIC, 0, 0, 0, 0, 0, 0, len(meta)))
+        f.write(meta)
+        pos = _HEADER.size + len(meta)
+        for key, value in _source_items(source):
+            key = key.encode("utf-8")
+            data = codec.dumps(value)
+            f.write(_RECORD.pack(len(key), len(data)))
+            f.write(key)
+            f.write(data)
+            keys.append(key)
+            offsets.append(pos)
+            pos += _RECORD.size + len(key) + len(data)
+
+        slots = _slot_count(len(keys))
+        buckets = max(1, len(keys) // BUCKET_SIZE)
+        salt = 0
+        while True:
+            hashes = [_hashes(key, salt, slots) for key in keys]
+            seeds = _place(hashes, slots, buckets)
+            if seeds is not None:
+                break
+            salt += 1
+        table = array("Q", bytes(8 * slots))
+        for (h0, h1, h2), offset in zip(hashes, offsets):
+            table[(h1 + seeds[h0 % buckets] * h2) % slots] = offset
+
+        seeds_pos = pos
+        f.write(b"".join(_SEED.pack(seed) for seed in seeds))
+        slots_pos = seeds_pos + _SEED.size * buckets
+        f.write(b"".join(_SLOT.pack(offset) for offset in table))
+        f.seek(0)
+        f.write(_HEADER.pack(FROZEN_MAGIC, len(keys), slots, buckets, salt, seeds_pos, slots_pos, len(meta)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename + ".frz")
+    return len(keys)
+
+
+class FrozenDB:
+
+    # The dbm-like side of a frozen file: bytes keys -> bytes values, read only
+
+    def __init__(self, filename):
+        self._filename = filename + ".frz"
+        self._map = None        # so close() (and __del__) work if the file can't be opened
+        with io.open(self._filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(FROZEN_MAGIC)] != FROZEN_MAGIC:
+            self._map.close()
+            raise error("{!r} is not a frozen shelf".format(self._filename))
+        _, self._count, self._slots, self._buckets, salt, self._seeds_pos, self._slots_pos, meta_len = \
+            _HEADER.unpack_from(self._map, 0)
+        self._salt = _SEED.pack(salt)
+        self._data_start = _HEADER.size + meta_len
+        self.meta = json.loads(self._map[_HEADER.size:self._data_start].decode("utf-8"))
+
+    def _check_open(self):
+        if self._map is None:
+            raise error("FrozenDB object has already been closed")
+
+    def _find(self, key):
+        # (start, end) of the value of key in the mapped file, or None
+
+        self._check_open()
+        digest = hashlib.blake2b(key, digest_size=24, salt=self._salt).digest()
+        h0 = int.from_bytes(digest[:8], "little")
+        seed = _SEED.unpack_from(self._map, self._seeds_pos + _SEED.size * (h0 % self._buckets))[0]
+        slots = self._slots
+        slot = (int.from_bytes(digest[8:16], "little") % slots +
+                seed * (int.from_bytes(digest[16:], "little") % (slots - 1) + 1)) % slots
+        offset = _SLOT.unpack_from(self._map, self._slots_pos + _SLOT.size * slot)[0]
+        if not offset:
+            return None
+        key_len, value_len = _RECORD.unpack_from(self._map, offset)
+        start = offset + _RECORD.size
+        if key_len != len(key) or self._map[start:start + key_len] != key:
+            return None
+        return start + key_len, start + key_len + value_len
+
+    def view(self, key):
+        # The value of key as a memoryview of the mapped file (no copy). Release it before closing
+
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        found = self._find(key)
+        if found is None:
+            raise KeyError(key)
+        return memoryview(self._map)[found[0]:found[1]]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        found = self._find(key)
+        if found is None:
+            raise KeyError(key)
+        return self._map[found[0]:found[1]]
+
+    def __contains__(self, key):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        return self._find(key) is not None
+
+    def __setitem__(self, key, value):
+        raise error("frozen shelves are read only")
+
+    def __delitem__(self, key):
+        raise error("frozen shelves are read only")
+
+    def scan(self, buffer_size=None):
+        # Every (key, value) pair in file order (buffer_size is there for shelf_scan, the file is mapped)
+
+        self._check_open()
+        pos = self._data_start
+        while pos < self._seeds_pos:
+            key_len, value_len = _RECORD.unpack_from(self._map, pos)
+            start = pos + _RECORD.size
+            pos = start + key_len + value_len
+            yield self._map[start:start + key_len], self._map[start + key_len:pos]
+
+    def keys(self):
+        return [key for key, _ in self.scan()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    __del__ = close
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FrozenShelf(shelve.Shelf):
+
+    # Read-only shelf over a frozen file. Unlike shelf_log.MappedShelf it keeps no decoded values:
+    # every locations[loc] decodes the record again, which is a few microseconds for a location,
+    # and the process holds nothing but the mapping
+
+    def __init__(self, filename, keyencoding="utf-8"):
+        db = FrozenDB(filename)
+        self.codec = shelf_codec.from_config(db.meta["codec"])
+        shelve.Shelf.__init__(self, db, keyencoding=keyencoding)
+
+    def __getitem__(self, key):
+        with self.dict.view(key.encode(self.keyencoding)) as data:
+            return self.codec.loads(data)
+
+
+def open(filename):
+    # Open <filename>.frz written by freeze()
+
+    return FrozenShelf(filename)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile shelves into read-only frozen files (<name>.frz)")
+    parser.add_argument("shelves", nargs="+", help="shelf file names without extension, e.g. locations")
+    args = parser.parse_args(argv)
+
+    for name in args.shelves:
+        print("{}: {} keys -> {}.frz".format(name, freeze(name), name))
+
+
+if __name__ == "__main__":
+    main()
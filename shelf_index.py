@@ -0,0 +1,275 @@
+# ================
+# shelf_index.py
+# ================
+
+# Secondary indexes: find the keys whose values contain something, without reading every value
+
+# "Which recipes use bread?" in 24_Recipes.py, or "which locations have an exit to the Hill ('2')?" in
+# cave_initialize.py, can only be answered by unpickling every value of the shelf and looking inside.
+
+# An IndexedShelf is given indexes when it is opened: a name and an extractor, a function that takes a
+# value and returns the terms to index it under (the ingredients of a recipe, the exit targets of a
+# location). Every assignment and del keeps an inverted index up to date: term -> the keys whose values
+# have it. Asking for a term is then one lookup, and costs as much as the number of keys it finds.
+
+#   import shelf_index
+#   with shelf_index.open("recipes", indexes={"ingredient": shelf_index.list_items}) as recipes:
+#       recipes["blt"] = ["bacon", "lettuce", "tomato", "bread"]
+#       print(recipes.lookup("ingredient", "bread"))      # ['beans_on_toast', 'blt']
+#       for snack, ingredients in recipes.find("ingredient", "bread"): ...
+#
+#   locations = shelf_index.open("locations", indexes={"exit_to": shelf_index.exit_targets})
+#   locations.lookup("exit_to", '2')                       # where you can get to the Hill from
+
+# The index is kept in a shelf_log shelf next to the shelf (<filename>.ix.log / .ix.idx):
+#   "p\0<index>\0<term>"  the keys with that term: a list of keys added and (key,) removal records, in
+#                         the order they happened. Both are appended (see LogShelf.append), so a change
+#                         writes one small record however many keys have the term
+#   "n\0<index>\0<term>"  [keys with the term, removal records in its list]. Once there are more removal
+#                         records than keys the list is written again without them, so a removal costs
+#                         O(1) amortized, and the list never gets more than about three times as long as
+#                         its keys (each removal record, and the key it took out)
+#   "k\0<key>"            the terms of every index for that key, so an old value's terms can be taken
+#                         out again without reading the old value
+#   "meta"                the indexes it holds, and shelf_bloom.file_signature() of the shelf's files
+# Terms are strings (extractors may return anything, it is turned into a string).
+# The file signature is saved on sync() and close(), the same way shelf_bloom saves it. If it doesn't match
+# when the shelf is opened again (it was changed without the index, or we crashed), the indexes are rebuilt
+# with one pass over the shelf. An index that is new, or whose extractor changed (then call rebuild()), is
+# built the same way.
+# With writeback=True, values changed in place are indexed when they are written back, on sync() or close().
+
+import dbm
+import shelve
+
+import shelf_bloom
+import shelf_log
+import shelf_scan
+
+__all__ = ["IndexedShelf", "list_items", "exit_targets", "open"]
+
+_META = "meta"
+_FORMAT = 2         # 1: posting lists were rewritten on every removal, and had no counts
+
+
+def list_items(value):
+    # Extractor for list values: the items themselves (the ingredients of a recipe)
+    return value
+
+
+def exit_targets(location):
+    # Extractor for cave_initialize.py locations: every location reachable from this one
+    return list(location["exits"].values()) + list(location["namedExits"].values())
+
+
+def _posting(name, term):
+    return "p\0{}\0{}".format(name, term)
+
+
+def _count(name, term):
+    return "n\0{}\0{}".format(name, term)
+
+
+def _replay(posting):
+    # The keys of a posting list: keys are added by strings and taken out by (key,) removal records
+
+    keys = set()
+    for item in posting:
+        if isinstance(item, str):
+            keys.add(item)
+        else:
+            keys.discard(item[0])
+    return keys
+
+
+class IndexedShelf(shelve.Shelf):
+
+    # filename: the shelf's file name (without extension), used for <filename>.ix
+    # indexes: {index name: extractor}. More can be added with add_index()
+
+    def __init__(self, dict, filename, indexes=None, protocol=None, writeback=False, keyencoding="utf-8",
+                 flag="c"):
+        shelve.Shelf.__init__(self, dict, protocol, writeback, keyencoding)
+        self._filename = filename
+        self._readonly = (flag == "r")
+        self._closed = False
+        self.indexes = {}
+        try:
+            self._ix = shelf_log.open(filename + ".ix", "r" if self._readonly else "c", sorted_index=True)
+        except BaseException:
+            self._closed = True
+            shelve.Shelf.close(self)
+            raise
+        meta = self._ix.get(_META, {"indexes": [], "files": None})
+        self._built = set(meta["indexes"])
+        if meta["files"] != shelf_bloom.file_signature(filename) or meta.get("format") != _FORMAT:
+            self._built = set()     # the shelf changed without us: every index has to be built again
+        self._changed = not self._built
+        try:
+            for name, extractor in (indexes or {}).items():
+                self.add_index(name, extractor)
+        except BaseException:
+            self.close()
+            raise
+
+    def add_index(self, name, extractor):
+        # Keep an index called name from now on, built now if the index file doesn't have it yet
+
+        if "\0" in name:
+            raise ValueError("index names can't contain NUL")
+        self.indexes[name] = extractor
+        if name not in self._built:
+            self.rebuild(name)
+
+    def _terms(self, name, value):
+        terms = self.indexes[name](value)
+        return sorted({str(term) for term in terms}) if terms else []
+
+    def rebuild(self, name=None):
+        # Build index "name" (default: all of them) again from every value of the shelf
+
+        if self._readonly:
+            raise shelf_log.error("index {!r} of {!r} is out of date, open the shelf for writing to rebuild it"
+                                  .format(name, self._filename))
+        names = [name] if name is not None else list(self.indexes)
+        if self.writeback:
+            self.sync()       # index the cached values as they are now
+        ix = self._ix
+        for old in names:
+            for prefix in ("p\0{}\0".format(old), "n\0{}\0".format(old)):
+                for posting in list(ix.keys_with_prefix(prefix)):
+                    del ix[posting]
+
+        # Every key's entry is written again, and the entries of keys that are no longer in the shelf
+        # (deleted without the index) are dropped: their old terms would otherwise be taken out again
+        # of postings the key is not in when it is written the next time
+        stale = {entry_key[2:] for entry_key in ix.keys_with_prefix("k\0")}
+        postings = {}
+        for key, value in shelf_scan.items(self):
+            stale.discard(key)
+            entry = ix.get("k\0" + key, {})
+            for index in names:
+                entry.pop(index, None)
+                terms = self._terms(index, value)
+                if terms:
+                    entry[index] = terms
+                for term in terms:
+                    postings.setdefault((index, term), []).append(key)
+            ix["k\0" + key] = entry
+        for key in stale:
+            del ix["k\0" + key]
+        for (index, term), keys in postings.items():
+            ix[_posting(index, term)] = sorted(keys)
+            ix[_count(index, term)] = [len(keys), 0]
+        self._built.update(names)
+        self._changed = True
+
+    def _reindex(self, key, value=None, deleted=False):
+        ix = self._ix
+        entry = ix.get("k\0" + key, {})
+        new_entry = {}
+        for name in self.indexes:
+            old_terms = set(entry.get(name, ()))
+            new_terms = set() if deleted else set(self._terms(name, value))
+            for term in old_terms - new_terms:
+                self._remove_posting(name, term, key)
+            for term in new_terms - old_terms:
+                live, removed = ix.get(_count(name, term), (0, 0))
+                ix.append(_posting(name, term), key)
+                ix[_count(name, term)] = [live + 1, removed]
+            if new_terms:
+                new_entry[name] = sorted(new_terms)
+        if new_entry:
+            ix["k\0" + key] = new_entry
+        elif entry:
+            del ix["k\0" + key]
+        self._changed = True
+
+    def _remove_posting(self, name, term, key):
+        # Take key out of the posting list of term: a (key,) removal record, or the list written again
+        # without its removal records once they would outnumber its keys. Nothing if key isn't in it
+
+        ix = self._ix
+        posting, count = _posting(name, term), _count(name, term)
+        keys = _replay(ix.get(posting, ()))
+        if key not in keys:
+            return
+        removed = ix.get(count, (0, 0))[1]
+        live = len(keys) - 1
+        if live <= 0:
+            for stale in (posting, count):
+                if stale in ix:
+                    del ix[stale]
+        elif removed + 1 > live:
+            ix[posting] = sorted(keys - {key})
+            ix[count] = [live, 0]
+        else:
+            ix.append(posting, (key,))
+            ix[count] = [live, removed + 1]
+
+    def __setitem__(self, key, value):
+        shelve.Shelf.__setitem__(self, key, value)
+        self._reindex(key, value)
+
+    def __delitem__(self, key):
+        shelve.Shelf.__delitem__(self, key)
+        self._reindex(key, deleted=True)
+
+    def lookup(self, name, term):
+        # The keys (sorted) whose values have term in index name
+
+        if name not in self.indexes:
+            raise KeyError("no index called {!r}".format(name))
+        return sorted(_replay(self._ix.get(_posting(name, str(term)), [])))
+
+    def find(self, name, term):
+        # (key, value) of every key lookup() finds
+
+        for key in self.lookup(name, term):
+            yield key, self[key]
+
+    def terms(self, name):
+        # Every term of index name, in sorted order
+
+        if name not in self.indexes:
+            raise KeyError("no index called {!r}".format(name))
+        prefix = "p\0{}\0".format(name)
+        return [posting[len(prefix):] for posting in self._ix.keys_with_prefix(prefix)]
+
+    def _save(self):
+        # Write the meta entry if the indexes or the shelf's files changed, then sync the .ix shelf
+
+        if self._readonly:
+            return
+        files = shelf_bloom.file_signature(self._filename)
+        if self._changed or self._ix.get(_META, {}).get("files") != files:
+            # an index nobody registered this time wasn't kept up to date
+            self._ix[_META] = {"indexes": sorted(self._built & set(self.indexes)), "files": files,
+                               "format": _FORMAT}
+            self._changed = False
+        self._ix.sync()
+
+    def sync(self):
+        shelve.Shelf.sync(self)
+        self._save()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.sync()
+        finally:
+            try:
+                shelve.Shelf.close(self)
+            finally:
+                try:
+                    self._save()       # the signature of the files as shelve.Shelf.close() left them
+                finally:
+                    self._ix.close()
+
+
+def open(filename, flag="c", protocol=None, writeback=False, indexes=None):
+    # Same as shelve.open (same dbm files), with the secondary indexes in <filename>.ix
+
+    return IndexedShelf(dbm.open(filename, flag), filename, indexes, protocol, writeback, flag=flag)
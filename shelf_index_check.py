@@ -0,0 +1,139 @@
+# ======================
+# shelf_index_check.py
+# ======================
+
+# Checks for shelf_index.py
+
+# The index has to give the same answers as reading every value, however the shelf got into its state:
+#   signature_rebuild   the shelf is changed with plain shelve (the index doesn't see it), so the next open
+#                       finds a different file signature and rebuilds. Keys written after that must not
+#                       take other keys out of the postings
+#   random_updates      random assignments and deletes with reopens in between, compared after every
+#                       reopen with a lookup done by hand; posting lists stay within their documented size
+#
+#   python shelf_index_check.py            # prints one line per check, exits with 1 if one fails
+
+import argparse
+import os
+import random
+import shelve
+import shutil
+import sys
+import tempfile
+
+import shelf_index
+
+__all__ = ["CHECKS", "run"]
+
+INDEXES = {"ingredient": shelf_index.list_items}
+INGREDIENTS = ["bacon", "lettuce", "tomato", "bread", "beans", "eggs", "butter", "milk", "cheese"]
+
+
+class IndexCheckError(AssertionError):
+    pass
+
+
+def _compare(shelf, expected, check):
+    # Every term's lookup against the same question answered from expected ({key: ingredients})
+
+    for term in INGREDIENTS:
+        wanted = sorted(key for key, value in expected.items() if term in value)
+        found = shelf.lookup("ingredient", term)
+        if found != wanted:
+            raise IndexCheckError("{}: lookup({!r}) gave {!r}, expected {!r}"
+                                  .format(check, term, found, wanted))
+    terms = sorted({term for value in expected.values() for term in value})
+    found = shelf.terms("ingredient")
+    if found != terms:
+        raise IndexCheckError("{}: terms() gave {!r}, expected {!r}".format(check, found, terms))
+
+
+def signature_rebuild(name):
+    expected = {"a": ["bread"], "b": ["bread"], "c": ["bread"]}
+    with shelf_index.open(name, indexes=INDEXES) as recipes:
+        for key, value in expected.items():
+            recipes[key] = value
+
+    with shelve.open(name) as plain:      # behind the index's back
+        del plain["a"]
+    del expected["a"]
+
+    with shelf_index.open(name, indexes=INDEXES) as recipes:
+        _compare(recipes, expected, "signature_rebuild (after the rebuild)")
+        recipes["a"] = ["cheese"]
+        recipes["b"] = ["bacon"]
+        expected.update(a=["cheese"], b=["bacon"])
+        _compare(recipes, expected, "signature_rebuild (writes after the rebuild)")
+    with shelf_index.open(name, flag="r", indexes=INDEXES) as recipes:
+        _compare(recipes, expected, "signature_rebuild (reopened)")
+
+
+def random_updates(name):
+    rng = random.Random(1)
+    expected = {}
+    recipes = shelf_index.open(name, indexes=INDEXES)
+    try:
+        for step in range(3000):
+            key = "recipe{}".format(rng.randrange(60))
+            if key in expected and rng.random() < 0.3:
+                del recipes[key]
+                del expected[key]
+            else:
+                value = rng.sample(INGREDIENTS, rng.randrange(4))
+                recipes[key] = value
+                expected[key] = value
+            if step % 500 == 499:
+                recipes.close()
+                recipes = shelf_index.open(name, indexes=INDEXES)
+                _compare(recipes, expected, "random_updates (step {})".format(step))
+        for term in INGREDIENTS:
+            keys = sum(term in value for value in expected.values())
+            posting = recipes._ix.get(shelf_index._posting("ingredient", term), [])
+            if len(posting) > 3 * keys + 1:
+                raise IndexCheckError("random_updates: posting list of {!r} has {} items for {} keys"
+                                      .format(term, len(posting), keys))
+    finally:
+        recipes.close()
+
+
+CHECKS = {
+    "signature_rebuild": signature_rebuild,
+    "random_updates": random_updates,
+}
+
+
+def run(checks=None):
+    # Run the checks (default: all) in a temporary directory. Returns {check: None if it passed, else the error}
+
+    results = {}
+    directory = tempfile.mkdtemp(prefix="shelf_index_check")
+    try:
+        for check in checks or CHECKS:
+            try:
+                CHECKS[check](os.path.join(directory, check))
+            except IndexCheckError as failed:
+                results[check] = str(failed)
+            else:
+                results[check] = None
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that shelf_index answers like a scan of the shelf")
+    parser.add_argument("checks", nargs="*", help="default: all of " + ", ".join(CHECKS))
+    args = parser.parse_args(argv)
+    for check in args.checks:
+        if check not in CHECKS:
+            parser.error("no check called {!r}".format(check))
+
+    failed = 0
+    for check, error in run(args.checks).items():
+        print("{:<24}{}".format(check, "ok" if error is None else "FAILED: " + error))
+        failed += error is not None
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
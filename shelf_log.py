@@ -0,0 +1,1361 @@
+# ==============
+# shelf_log.py
+# ==============
+
+# A log-structured storage backend that "shelve" can use instead of dbm.dumb
+
+# Every shelf in this project ends up in the dbm.dumb format (the .dir/.dat/.bak files)
+# dbm.dumb pads every value to a 512 byte block: the .dir file of the locations shelf cave_initialize.py
+# used to write had the line  '1', (512, 177)  (location '1' starts at byte 512 and is 177 bytes long)
+# and rewrites the whole .dir index every time the shelf is closed.
+
+# This module stores a shelf in two files instead:
+#   <name>.log  - append-only data file. Every write appends one record: header + key + value
+#   <name>.idx  - append-only index file. Every write appends one small entry: key + where the value is
+# So each assignment does O(1) I/O (two small appends) and there is no padding at all.
+
+# Overwritten and deleted values leave dead records in the .log file.
+# When enough of the file is dead, the live records are copied to a new file by a background thread
+# (compaction) and the new .log/.idx files are swapped in.
+
+# Usage is the same as shelve.open:
+#
+#   import shelf_log
+#   with shelf_log.open("locations") as locations:
+#       locations['1'] = {"desc": "This is the Road", ...}
+
+# Several processes can use the same shelf: one writer and any number of readers (flag "r").
+# The writer holds an exclusive lock on <name>.lock, so a second writer gets an error instead of
+# corrupting the files. Readers never lock anything: the files are only ever appended to (or replaced
+# as a whole by compaction), so a reader always sees a consistent state. It sees the state as of
+# opening, and picks up what the writer has flushed since (shelf.sync()) when it calls refresh().
+
+# Transactions: writes made inside "with shelf.transaction():" are kept in memory and written together
+# when the block ends, followed by a COMMIT record, then the .log is fsynced. The .log is the write-ahead
+# log: on opening, transaction records without their COMMIT record (a crash half way) are ignored and cut
+# off, so either all writes of a transaction are there or none of them. Threads committing at the same
+# time share one fsync (group commit): whoever fsyncs first also covers everyone who wrote before it.
+#
+#   with recipes.transaction():
+#       recipes["blt"] = recipes["blt"] + ["butter"]
+#       recipes["pasta"] = recipes["pasta"] + ["tomato"]
+
+# Appending to a list value: recipes.append("blt", "butter") writes only the new item, as an APPEND
+# record, instead of reading, changing and rewriting the whole list (recipes2["blt"].append("butter")
+# in 24_Recipes.py does nothing at all). Reading the key decodes the list and its appended items;
+# compaction merges them back into one record.
+
+# Opening without reading the index: LogDB(name, "r", lazy=True) (MappedShelf does this) doesn't read the
+# .idx file into a dict. It maps the .sidx file (a sorted copy of the index, see shelf_sorted.py), looks
+# keys up in it with a binary search, and only reads what was written to the .log after the .sidx was made
+# (normally nothing: a writer with sorted_index=True brings the .sidx up to date when it closes). So opening
+# takes the same time for 10 keys or 10 million, and many processes share the pages of one .sidx file.
+# Without a usable .sidx (no sorted_index, another generation, appended fragments) it opens the usual way.
+
+import contextlib
+import functools
+import heapq
+import io
+import json
+import mmap
+import os
+import shelve
+import struct
+import threading
+import zlib
+from collections.abc import MutableMapping
+
+try:
+    import fcntl
+except ImportError:    # Windows: no writer lock, only use one writer at a time yourself
+    fcntl = None
+
+import shelf_codec
+import shelf_nested
+import shelf_sorted
+
+__all__ = ["error", "LogDB", "LogShelf", "MappedShelf", "Transaction", "load", "open", "open_mapped"]
+
+error = OSError  # same as dbm.dumb, so "except dbm.error" style code keeps working
+
+# File headers: magic (8 bytes), generation (8 bytes), length of the JSON metadata (4 bytes), metadata
+# The generation is bumped by every compaction, so a .log and .idx that don't belong together are detected
+
+LOG_MAGIC = b"SHLFLOG1"
+IDX_MAGIC = b"SHLFIDX1"
+_FILE_HEADER = struct.Struct("<8sQI")
+
+# A .log record: crc32 of (kind, key, value), kind, key length, value length, then key and value bytes
+# A .idx entry: kind, key length, offset of the .log record, value length, then key bytes
+
+_RECORD = struct.Struct("<IBII")
+_ENTRY = struct.Struct("<BIQI")
+
+PUT = 1
+DELETE = 2
+TXN_PUT = 3       # written by a transaction: only count once the COMMIT record after them is there
+TXN_DELETE = 4
+COMMIT = 5        # no key, no value
+APPEND = 6        # a fragment added to the value of an existing key (see LogDB.append)
+
+_PUTS = (PUT, TXN_PUT)
+_TXN_KINDS = (TXN_PUT, TXN_DELETE)
+
+FORMAT_VERSION = 1
+
+
+def _read_header(f, magic):
+    raw = f.read(_FILE_HEADER.size)
+    if len(raw) < _FILE_HEADER.size:
+        return None
+    file_magic, generation, meta_len = _FILE_HEADER.unpack(raw)
+    if file_magic != magic:
+        raise error("{!r} is not a shelf_log file".format(f.name))
+    meta = f.read(meta_len)
+    if len(meta) < meta_len:
+        return None
+    return generation, json.loads(meta.decode("utf-8")), _FILE_HEADER.size + meta_len
+
+
+def _write_header(f, magic, generation, meta):
+    meta = json.dumps(meta, sort_keys=True).encode("utf-8")
+    f.write(_FILE_HEADER.pack(magic, generation, len(meta)))
+    f.write(meta)
+    return _FILE_HEADER.size + len(meta)
+
+
+def _pack_record(kind, key, value):
+    crc = zlib.crc32(value, zlib.crc32(key, kind))
+    return _RECORD.pack(crc, kind, len(key), len(value)) + key + value
+
+
+def _iter_records(f, start):
+    # Walk the .log file from "start" and yield (record offset, kind, key, value, end offset)
+    # A torn record at the end of the file (crash in the middle of a write) stops the walk
+
+    f.seek(start)
+    pos = start
+    while True:
+        raw = f.read(_RECORD.size)
+        if len(raw) < _RECORD.size:
+            return
+        crc, kind, key_len, value_len = _RECORD.unpack(raw)
+        key = f.read(key_len)
+        value = f.read(value_len)
+        if len(key) < key_len or len(value) < value_len:
+            return
+        if zlib.crc32(value, zlib.crc32(key, kind)) != crc:
+            return
+        end = pos + _RECORD.size + key_len + value_len
+        yield pos, kind, key, value, end
+        pos = end
+
+
+def _iter_committed(f, start):
+    # Like _iter_records, but the records of a transaction are held back until its COMMIT record.
+    # Yields (records, end offset) for every plain record or committed transaction, records being
+    # (kind, key, offset, value) tuples
+
+    pending = []
+    for offset, kind, key, value, end in _iter_records(f, start):
+        pending.append((kind, key, offset, value))
+        if kind not in _TXN_KINDS:
+            yield pending, end
+            pending = []
+
+
+def _iter_entries(f, log_size):
+    # Read .idx entries from the current position of f. Yields (entries, position in f after them) for
+    # every plain entry or committed transaction, entries being (kind, key, offset, value length) tuples.
+    # Stops at a torn entry or one whose .log record is not (completely) in the first log_size bytes
+
+    pending = []
+    while True:
+        raw = f.read(_ENTRY.size)
+        if len(raw) < _ENTRY.size:
+            return
+        kind, key_len, offset, value_len = _ENTRY.unpack(raw)
+        key = f.read(key_len)
+        if len(key) < key_len or offset + _RECORD.size + key_len + value_len > log_size:
+            return
+        pending.append((kind, key, offset, value_len))
+        if kind not in _TXN_KINDS:
+            yield pending, f.tell()
+            pending = []
+
+
+class LogDB(MutableMapping):
+
+    # flag works like dbm.open: 'r' read only, 'w' read/write, 'c' create if missing, 'n' always start empty
+    # autocompact starts a background compaction once dead bytes pass both compact_min_bytes and
+    # compact_ratio * live bytes
+    # use_mmap (read only) maps the .log file, so reading a value is a slice of memory instead of a pread
+    # sorted_index keeps <name>.sidx, a sorted copy of the keys, for ordered_keys() (see shelf_sorted.py)
+    # lazy (read only) opens the shelf from the .sidx file instead of loading the whole index, if it can.
+    # db.lazy tells whether it did
+    # meta is extra JSON-able information written into the .log header when the file is created
+    # (LogShelf records its codec there). It can be read back from db.meta
+    # merge(value, fragments) -> value combines a value with the fragments appended to it (db.append).
+    # The shelves set it from their codec; reading an appended value without it is an error
+
+    def __init__(self, filebasename, flag="c", mode=0o666, autocompact=True,
+                 compact_min_bytes=1 << 20, compact_ratio=1.0, use_mmap=False, sorted_index=False,
+                 meta=None, lazy=False):
+        self._lock = threading.RLock()
+        self._log = None
+        self._idx = None
+        self._map = None
+        self._run = None
+        self._lockf = None
+        self._compactor = None
+        self._local = threading.local()      # .txn: the transaction active in this thread
+        self._fsync_lock = threading.Lock()
+        self._commit_seq = 0                 # transactions committed so far ...
+        self._synced_seq = 0                 # ... and how many of them are fsynced
+        if flag not in ("r", "w", "c", "n"):
+            raise ValueError("Flag must be one of 'r', 'w', 'c', or 'n'")
+        if use_mmap and flag != "r":
+            raise ValueError("use_mmap needs flag 'r'")
+        if lazy and flag != "r":
+            raise ValueError("lazy needs flag 'r'")
+        self._logfile = filebasename + ".log"
+        self._idxfile = filebasename + ".idx"
+        self._sidxfile = filebasename + ".sidx"
+        self._lockfile = filebasename + ".lock"
+        self._mode = mode
+        self._readonly = (flag == "r")
+        self.autocompact = autocompact and not self._readonly
+        self.compact_min_bytes = compact_min_bytes
+        self.compact_ratio = compact_ratio
+        self._use_mmap = use_mmap
+
+        self._index = {}       # key (bytes) -> (record offset, value length)
+        self._appends = {}     # key (bytes) -> [(record offset, value length)] of its APPEND fragments
+        self.merge = None
+        self._live = 0         # bytes of .log records that are still reachable
+        self._dead = 0         # bytes of .log records that were overwritten or deleted
+        self._delta = None     # with sorted_index: keys written since the .sidx file was made
+        self._sorted_index = sorted_index
+        self._lazy = lazy
+        self.lazy = False      # True: _index only has the keys written after the .sidx file (self._run) ...
+        self._deleted = set()  # ... and these keys of the .sidx file were deleted since
+
+        if not self._readonly:
+            self._lock_writer()
+        if flag == "n":
+            for name in (self._logfile, self._idxfile, self._sidxfile):
+                if os.path.exists(name):
+                    os.remove(name)
+        if not os.path.exists(self._logfile):
+            if flag in ("r", "w"):
+                raise error("need 'c' or 'n' flag to open new db")
+            self._create(meta)
+        self._load()
+        if sorted_index and not self.lazy:
+            self._load_sorted()
+
+    # ----------------------------------------------------------------
+    # opening, recovery
+    # ----------------------------------------------------------------
+
+    def _lock_writer(self):
+        self._lockf = io.open(self._lockfile, "ab")
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._lockf.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lockf.close()
+            self._lockf = None
+            raise error("{!r} is already open for writing in another process".format(self._logfile))
+
+    def _create(self, extra_meta):
+        meta = dict(extra_meta or {})
+        meta["format"] = FORMAT_VERSION
+        with io.open(self._logfile, "wb") as f:
+            _write_header(f, LOG_MAGIC, 0, meta)
+        with io.open(self._idxfile, "wb") as f:
+            _write_header(f, IDX_MAGIC, 0, {})
+        for name in (self._logfile, self._idxfile):
+            try:
+                os.chmod(name, self._mode)
+            except OSError:
+                pass
+
+    def _load(self):
+        mode = "rb" if self._readonly else "r+b"
+        self._log = io.open(self._logfile, mode)
+        header = _read_header(self._log, LOG_MAGIC)
+        if header is None:
+            raise error("{!r} has a damaged header".format(self._logfile))
+        self._generation, self.meta, self._data_start = header
+
+        log_size = os.fstat(self._log.fileno()).st_size
+        if self._lazy and self._load_lazy(log_size):
+            return
+
+        # Read the index first. It only holds keys and offsets, so this is much less than the .log file
+
+        indexed_end = self._data_start
+        idx_good = 0
+        idx_header = None
+        if os.path.exists(self._idxfile):
+            with io.open(self._idxfile, "rb") as f:
+                idx_header = _read_header(f, IDX_MAGIC)
+                if idx_header is not None and idx_header[0] == self._generation:
+                    idx_good = idx_header[2]
+                    for entries, idx_good in _iter_entries(f, log_size):
+                        for kind, key, offset, value_len in entries:
+                            self._apply(kind, key, offset, value_len)
+                        indexed_end = offset + _RECORD.size + len(key) + value_len
+
+        # Anything in the .log file past the last index entry was written but never indexed (crash
+        # between the two appends). Replay it, and cut off a torn record or unfinished transaction at the end
+
+        tail = []
+        end = indexed_end
+        for records, end in _iter_committed(self._log, indexed_end):
+            for kind, key, offset, value in records:
+                self._apply(kind, key, offset, len(value))
+                tail.append((kind, key, offset, len(value)))
+        self._size = end
+        self._idx_pos = idx_good    # readers: where refresh() continues reading the .idx file
+
+        if self._readonly:
+            self._log.seek(0, io.SEEK_END)
+            if self._use_mmap:
+                self._map = mmap.mmap(self._log.fileno(), self._size, access=mmap.ACCESS_READ)
+            return
+
+        # Only truncate what there is to cut off: a truncate() changes the file's modification time even
+        # when it cuts nothing, and shelf_bloom / shelf_index compare those times to see if the shelf changed
+
+        if log_size != self._size:
+            self._log.truncate(self._size)
+        self._log.seek(self._size)
+        if idx_header is None or idx_header[0] != self._generation:
+            self._rewrite_index()
+        else:
+            self._idx = io.open(self._idxfile, "r+b")
+            if os.fstat(self._idx.fileno()).st_size != idx_good:
+                self._idx.truncate(idx_good)
+            self._idx.seek(idx_good)
+            for kind, key, offset, value_len in tail:
+                self._idx.write(_ENTRY.pack(kind, len(key), offset, value_len) + key)
+            self._idx.flush()
+
+    def _load_lazy(self, log_size):
+        # Use the .sidx file as the index and replay only the .log records written after it.
+        # False if there is no .sidx file that can be used
+
+        try:
+            run = shelf_sorted.SortedIndex(self._sidxfile)
+        except (OSError, ValueError):
+            return False
+        if run.generation != self._generation or run.covered_end > log_size or run.appended:
+            run.close()
+            return False
+        self.lazy = True
+        self._run = run
+        self._delta = shelf_sorted.SortedKeys()
+        end = run.covered_end
+        for records, end in _iter_committed(self._log, run.covered_end):
+            for kind, key, offset, value in records:
+                self._apply(kind, key, offset, len(value))
+        self._size = end
+        self._log.seek(0, io.SEEK_END)
+        if self._use_mmap:
+            self._map = mmap.mmap(self._log.fileno(), self._size, access=mmap.ACCESS_READ)
+        return True
+
+    def _apply(self, kind, key, offset, value_len):
+        size = _RECORD.size + len(key) + value_len
+        if kind == COMMIT:
+            self._dead += size
+            return
+        if kind == APPEND:
+            self._appends.setdefault(key, []).append((offset, value_len))
+            self._live += size
+            return
+        old = self._index.pop(key, None)
+        fragments = self._appends.pop(key, ())
+        if old is not None:
+            old_size = _RECORD.size + len(key) + old[1]
+            for _, fragment_len in fragments:
+                old_size += _RECORD.size + len(key) + fragment_len
+            self._live -= old_size
+            self._dead += old_size
+        if self.lazy:
+            if kind in _PUTS:
+                self._deleted.discard(key)
+            else:
+                self._deleted.add(key)
+        if kind in _PUTS:
+            self._index[key] = (offset, value_len)
+            self._live += size
+            if self._delta is not None:
+                self._delta.add(key)
+        else:
+            self._dead += size
+
+    def _rewrite_index(self):
+        # Build a fresh .idx for the current .log (missing index, or left over from another generation)
+
+        tmp = self._idxfile + ".tmp"
+        with io.open(tmp, "wb") as f:
+            _write_header(f, IDX_MAGIC, self._generation, {})
+            for key, (offset, value_len) in self._index.items():
+                f.write(_ENTRY.pack(PUT, len(key), offset, value_len) + key)
+                for offset, value_len in self._appends.get(key, ()):
+                    f.write(_ENTRY.pack(APPEND, len(key), offset, value_len) + key)
+        os.replace(tmp, self._idxfile)
+        self._idx = io.open(self._idxfile, "r+b")
+        self._idx.seek(0, io.SEEK_END)
+
+    # ----------------------------------------------------------------
+    # mapping interface
+    # ----------------------------------------------------------------
+
+    def _check_open(self):
+        if self._log is None:
+            raise error("LogDB object has already been closed")
+
+    def _check_writable(self):
+        self._check_open()
+        if self._readonly:
+            raise error("The database is opened for reading only")
+
+    def _locate(self, key):
+        # (record offset, value length) of the value of key. KeyError if there is none
+
+        try:
+            return self._index[key]
+        except KeyError:
+            if not self.lazy or key in self._deleted:
+                raise
+        found = self._run.find(key)
+        if found is None:
+            raise KeyError(key)
+        return found
+
+    def _has(self, key):
+        if key in self._index:
+            return True
+        return self.lazy and key not in self._deleted and self._run.find(key) is not None
+
+    def _pending(self, key):
+        # The value this thread's transaction wrote for key (None: deleted), or _NOT_PENDING
+
+        txn = getattr(self._local, "txn", None)
+        if txn is None:
+            return _NOT_PENDING
+        return txn.writes.get(key, _NOT_PENDING)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        pending = self._pending(key)
+        if pending is not _NOT_PENDING:
+            if pending is None:
+                raise KeyError(key)
+            return pending
+        with self._lock:
+            self._check_open()
+            offset, value_len = self._locate(key)
+            value = self._read_value(offset, len(key), value_len)
+            if key in self._appends:
+                return self._merge(key, value)
+            return value
+
+    def _merge(self, key, value):
+        if self.merge is None:
+            raise error("{!r} has appended fragments, open the file as a shelf to read it".format(key))
+        return self.merge(value, [self._read_value(offset, len(key), value_len)
+                                  for offset, value_len in self._appends[key]])
+
+    def parts(self, key):
+        # The stored value of key followed by the fragments appended to it since, without merging them
+
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        pending = self._pending(key)
+        if pending is not _NOT_PENDING:
+            if pending is None:
+                raise KeyError(key)
+            return [pending]
+        with self._lock:
+            self._check_open()
+            offset, value_len = self._locate(key)
+            return [self._read_value(offset, len(key), value_len)] + \
+                [self._read_value(fragment, len(key), fragment_len)
+                 for fragment, fragment_len in self._appends.get(key, ())]
+
+    def _read_value(self, offset, key_len, value_len):
+        start = offset + _RECORD.size + key_len
+        if self._map is not None:
+            return self._map[start:start + value_len]
+        self._log.flush()
+        return os.pread(self._log.fileno(), value_len, start)
+
+    def view(self, key):
+        # Like db[key] but returns a memoryview. With use_mmap it points straight into the mapped file
+        # (no copy). Release it (or use it in a "with" block) before closing the db
+
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        pending = self._pending(key)
+        if pending is not _NOT_PENDING:
+            if pending is None:
+                raise KeyError(key)
+            return memoryview(pending)
+        with self._lock:
+            self._check_open()
+            offset, value_len = self._locate(key)
+            if key in self._appends:
+                return memoryview(self._merge(key, self._read_value(offset, len(key), value_len)))
+            if self._map is None:
+                return memoryview(self._read_value(offset, len(key), value_len))
+            start = offset + _RECORD.size + len(key)
+            return memoryview(self._map)[start:start + value_len]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        elif not isinstance(key, (bytes, bytearray)):
+            raise TypeError("keys must be bytes or strings")
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        elif not isinstance(value, (bytes, bytearray)):
+            raise TypeError("values must be bytes or strings")
+        txn = getattr(self._local, "txn", None)
+        with self._lock:
+            self._check_writable()
+            if txn is not None:
+                txn.writes[bytes(key)] = bytes(value)
+                return
+            self._append(PUT, bytes(key), bytes(value))
+
+    def __delitem__(self, key):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        txn = getattr(self._local, "txn", None)
+        with self._lock:
+            self._check_writable()
+            if txn is not None:
+                if txn.writes.get(key, b"" if key in self._index else None) is None:
+                    raise KeyError(key)
+                txn.writes[key] = None
+                return
+            if key not in self._index:
+                raise KeyError(key)
+            self._append(DELETE, key, b"")
+
+    def append(self, key, fragment):
+        # Add fragment to the value of an existing key with one small APPEND record, without rewriting the
+        # value. Reading the key returns merge(value, fragments), see "merge" above
+
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        fragment = bytes(fragment)
+        txn = getattr(self._local, "txn", None)
+        with self._lock:
+            self._check_writable()
+            if txn is not None:
+                if self.merge is None:
+                    raise error("append in a transaction needs a merge function")
+                txn.writes[key] = self.merge(self[key], [fragment])
+                return
+            if key not in self._index:
+                raise KeyError(key)
+            self._append(APPEND, key, fragment)
+
+    def _append(self, kind, key, value):
+        offset = self._size
+        self._log.write(_pack_record(kind, key, value))
+        self._idx.write(_ENTRY.pack(kind, len(key), offset, len(value)) + key)
+        self._size = offset + _RECORD.size + len(key) + len(value)
+        self._apply(kind, key, offset, len(value))
+        self._maybe_merge_sorted()
+        self._maybe_compact()
+
+    def load(self, items, batch_size=4096):
+        # Bulk load: write many (key, value) pairs at once.
+        # Each batch is packed into one contiguous buffer for the .log and one for the .idx,
+        # so the files are written front to back in a few large writes instead of two per key
+
+        if hasattr(items, "items"):
+            items = items.items()
+        count = 0
+        log_buf = bytearray()
+        idx_buf = bytearray()
+        batch = []
+        with self._lock:
+            self._check_writable()
+            for key, value in items:
+                if isinstance(key, str):
+                    key = key.encode("utf-8")
+                if isinstance(value, str):
+                    value = value.encode("utf-8")
+                key = bytes(key)
+                value = bytes(value)
+                offset = self._size + len(log_buf)
+                log_buf += _pack_record(PUT, key, value)
+                idx_buf += _ENTRY.pack(PUT, len(key), offset, len(value))
+                idx_buf += key
+                batch.append((key, offset, len(value)))
+                if len(batch) >= batch_size:
+                    self._write_batch(log_buf, idx_buf, batch)
+                    count += len(batch)
+                    log_buf = bytearray()
+                    idx_buf = bytearray()
+                    batch = []
+            if batch:
+                self._write_batch(log_buf, idx_buf, batch)
+                count += len(batch)
+            self._maybe_merge_sorted()
+            self._maybe_compact()
+        return count
+
+    def _write_batch(self, log_buf, idx_buf, batch):
+        self._log.write(log_buf)
+        self._idx.write(idx_buf)
+        self._size += len(log_buf)
+        for key, offset, value_len in batch:
+            self._apply(PUT, key, offset, value_len)
+
+    # ----------------------------------------------------------------
+    # transactions
+    # ----------------------------------------------------------------
+
+    def transaction(self, durable=True):
+        # A Transaction to use in a "with" block: db[key] = value and del db[key] in this thread are kept
+        # until the block ends and then committed together, or thrown away if the block raises.
+        # durable=False skips the fsync (still all or nothing, but the last commits may be lost in a crash)
+
+        self._check_writable()
+        return Transaction(self, durable)
+
+    def _commit(self, writes, durable):
+        with self._lock:
+            self._check_writable()
+            offset = self._size
+            log_buf = bytearray()
+            idx_buf = bytearray()
+            records = []
+            for key, value in writes.items():
+                if value is None:
+                    if key not in self._index:
+                        continue      # deleted by someone else in the meantime
+                    kind, value = TXN_DELETE, b""
+                else:
+                    kind = TXN_PUT
+                records.append((kind, key, value))
+            if not records:
+                return
+            records.append((COMMIT, b"", b""))
+            applied = []
+            for kind, key, value in records:
+                log_buf += _pack_record(kind, key, value)
+                idx_buf += _ENTRY.pack(kind, len(key), offset, len(value))
+                idx_buf += key
+                applied.append((kind, key, offset, len(value)))
+                offset += _RECORD.size + len(key) + len(value)
+
+            # The COMMIT index entry goes last too, so an .idx cut off in the middle of a transaction
+            # is replayed from the .log instead
+            self._log.write(log_buf)
+            self._idx.write(idx_buf)
+            self._size = offset
+            for entry in applied:
+                self._apply(*entry)
+            self._commit_seq += 1
+            seq = self._commit_seq
+            self._maybe_merge_sorted()
+            self._maybe_compact()
+        if durable:
+            self._sync_log(seq)
+
+    def _sync_log(self, seq):
+        # Group commit: make sure commit number "seq" is on disk. One thread at a time fsyncs, and that
+        # fsync covers every commit written before it started, so the threads that were waiting for it
+        # usually find their commit already synced and return without an fsync of their own
+
+        with self._fsync_lock:
+            if self._synced_seq >= seq:
+                return
+            with self._lock:
+                self._check_open()
+                self._log.flush()
+                upto = self._commit_seq
+                fd = self._log.fileno()
+            os.fsync(fd)
+            self._synced_seq = upto
+
+    def __contains__(self, key):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        pending = self._pending(key)
+        if pending is not _NOT_PENDING:
+            return pending is not None
+        with self._lock:
+            self._check_open()
+            return self._has(key)
+
+    def refresh(self):
+        # Readers (flag "r"): pick up what the writer process has flushed since we opened or last refreshed.
+        # Returns the list of keys that changed, or None if the writer compacted the shelf in the meantime
+        # (then everything was reloaded and any key may have changed). Writers are always up to date
+
+        with self._lock:
+            self._check_open()
+            if not self._readonly:
+                return []
+            try:
+                replaced = os.stat(self._logfile).st_ino != os.fstat(self._log.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = False     # in the middle of being swapped by compaction, try again later
+            if replaced:
+                self._reload()
+                return None
+
+            changed = []
+            if self.lazy:
+                # No .idx position to continue from: read the new .log records themselves
+                for records, self._size in _iter_committed(self._log, self._size):
+                    for kind, key, offset, value in records:
+                        self._apply(kind, key, offset, len(value))
+                        if kind != COMMIT:
+                            changed.append(key)
+                self._log.seek(0, io.SEEK_END)
+                if self._map is not None and changed:
+                    self._map.close()
+                    self._map = mmap.mmap(self._log.fileno(), self._size, access=mmap.ACCESS_READ)
+                return changed
+
+            # Only entries whose .log record is completely in the file count; the writer may have
+            # flushed the .idx entry before the record itself
+
+            log_size = os.fstat(self._log.fileno()).st_size
+            with io.open(self._idxfile, "rb") as f:
+                header = _read_header(f, IDX_MAGIC)
+                if header is None or header[0] != self._generation:
+                    return changed
+                f.seek(self._idx_pos)
+                for entries, self._idx_pos in _iter_entries(f, log_size):
+                    for kind, key, offset, value_len in entries:
+                        if offset >= self._size:   # not already replayed from the .log tail when we opened
+                            self._apply(kind, key, offset, value_len)
+                            self._size = offset + _RECORD.size + len(key) + value_len
+                            if kind != COMMIT:
+                                changed.append(key)
+
+            if self._map is not None and changed:
+                self._map.close()
+                self._map = mmap.mmap(self._log.fileno(), self._size, access=mmap.ACCESS_READ)
+            return changed
+
+    def _reload(self):
+        if self._map is not None:
+            self._map.close()
+        self._log.close()
+        self._log = self._map = self._run = None
+        self._index = {}
+        self._appends = {}
+        self._deleted = set()
+        self._live = self._dead = 0
+        self._delta = None
+        self._load()
+        if self._sorted_index and not self.lazy:
+            self._load_sorted()
+
+    def scan(self, buffer_size=1 << 20):
+        # Every live (key, value) pair, read by walking the .log file from front to back with
+        # buffer_size reads, instead of one random read per key. The pairs come in file order,
+        # as they were when the scan started (later writes are not seen)
+
+        with self._lock:
+            self._check_open()
+            if not self._readonly:
+                self._log.flush()
+            live = dict(self._index)
+            appends = {key: list(fragments) for key, fragments in self._appends.items()}
+            run = self._run if self.lazy else None
+            deleted = set(self._deleted)
+            start = self._data_start
+            end = self._size
+            log = io.open(self._logfile, "rb", buffering=buffer_size)
+        with log:
+            for offset, kind, key, value, record_end in _iter_records(log, start):
+                if record_end > end:
+                    break
+                if kind not in _PUTS:
+                    continue
+                position = live.get(key)
+                if position is None and run is not None and key not in deleted:
+                    position = run.find(key)
+                if position is not None and position[0] == offset:
+                    if key in appends:
+                        # the fragments are further on in the file: read them and merge
+                        fragments = [os.pread(log.fileno(), fragment_len, fragment + _RECORD.size + len(key))
+                                     for fragment, fragment_len in appends[key]]
+                        value = self.merge(value, fragments)
+                    yield key, value
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self._lock:
+            self._check_open()
+            if self.lazy:
+                return list(self.ordered_keys())
+            return list(self._index)
+
+    def __len__(self):
+        with self._lock:
+            self._check_open()
+            if not self.lazy:
+                return len(self._index)
+            run = self._run
+            count = len(run) + sum(1 for key in self._index if run.find(key) is None)
+            return count - sum(1 for key in self._deleted if run.find(key) is not None)
+
+    def sync(self):
+        with self._lock:
+            self._check_open()
+            if not self._readonly:
+                self._log.flush()
+                self._idx.flush()
+
+    def close(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            try:
+                if self._log is not None and not self._readonly:
+                    self._log.flush()
+                    self._idx.flush()
+                    if self._delta:
+                        self._merge_sorted()     # so the next lazy open has nothing to replay
+            finally:
+                if self._map is not None:
+                    self._map.close()
+                if self._run is not None:
+                    self._run.close()
+                self._run = None
+                for f in (self._log, self._idx, self._lockf):
+                    if f is not None:
+                        f.close()    # closing the lock file also releases the writer lock
+                self._log = self._idx = self._map = self._lockf = None
+
+    __del__ = close
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # ----------------------------------------------------------------
+    # compaction
+    # ----------------------------------------------------------------
+
+    # Compaction copies the live records into <name>.log.compact while the shelf keeps working.
+    # Records appended to the old .log while the copy runs are copied over at the end (under the lock),
+    # then the new .idx and .log replace the old ones.
+    # If we crash half way, the generation numbers won't match and the index is rebuilt on the next open.
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self), "live_bytes": self._live, "dead_bytes": self._dead,
+                    "file_bytes": self._size, "generation": self._generation,
+                    "appended": sum(len(fragments) for fragments in self._appends.values())}
+
+    def _maybe_compact(self):
+        if not self.autocompact or self._compactor is not None:
+            return
+        if self._dead > self.compact_min_bytes and self._dead > self._live * self.compact_ratio:
+            self.compact(background=True)
+
+    def compact(self, background=False):
+        with self._lock:
+            self._check_writable()
+            if self._compactor is not None:
+                compactor = self._compactor
+            else:
+                compactor = threading.Thread(target=self._compact, name="shelf_log-compact", daemon=True)
+                self._compactor = compactor
+                compactor.start()
+        if not background:
+            compactor.join()
+
+    def _compact(self):
+        try:
+            with self._lock:
+                self._log.flush()
+                snapshot = sorted(self._index.items(), key=lambda item: item[1][0])
+                snapshot_appends = {key: list(fragments) for key, fragments in self._appends.items()}
+                if snapshot_appends and self.merge is None:
+                    raise error("compacting appended values needs a merge function")
+                copied_to = self._size
+                generation = self._generation + 1
+
+            new_log = self._logfile + ".compact"
+            new_idx = self._idxfile + ".compact"
+            index = {}
+            appends = {}
+            with io.open(self._logfile, "rb") as src, io.open(new_log, "wb") as dst, \
+                    io.open(new_idx, "wb") as idx:
+                pos = data_start = _write_header(dst, LOG_MAGIC, generation, self.meta)
+                _write_header(idx, IDX_MAGIC, generation, {})
+
+                def copy(kind, key, value):
+                    nonlocal pos
+                    dst.write(_pack_record(kind, key, value))
+                    idx.write(_ENTRY.pack(kind, len(key), pos, len(value)) + key)
+                    if kind == APPEND:
+                        appends.setdefault(key, []).append((pos, len(value)))
+                    elif kind in _PUTS:
+                        index[key] = (pos, len(value))
+                        appends.pop(key, None)
+                    elif kind != COMMIT:
+                        index.pop(key, None)
+                        appends.pop(key, None)
+                    pos += _RECORD.size + len(key) + len(value)
+
+                # The snapshot is sorted by offset, so the old file is read front to back
+
+                # Appended fragments are merged into their value here
+
+                for key, (offset, value_len) in snapshot:
+                    src.seek(offset + _RECORD.size + len(key))
+                    value = src.read(value_len)
+                    if key in snapshot_appends:
+                        value = self.merge(value, [os.pread(src.fileno(), fragment_len,
+                                                            fragment + _RECORD.size + len(key))
+                                                   for fragment, fragment_len in snapshot_appends[key]])
+                    copy(PUT, key, value)
+
+                with self._fsync_lock, self._lock:
+                    self._log.flush()
+                    for _, kind, key, value, _ in _iter_records(src, copied_to):
+                        copy(kind, key, value)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                    idx.flush()
+                    os.fsync(idx.fileno())
+                    dst.close()
+                    idx.close()
+
+                    self._log.close()
+                    self._idx.close()
+                    os.replace(new_idx, self._idxfile)
+                    os.replace(new_log, self._logfile)
+                    self._log = io.open(self._logfile, "r+b")
+                    self._log.seek(pos)
+                    self._idx = io.open(self._idxfile, "r+b")
+                    self._idx.seek(0, io.SEEK_END)
+                    self._generation = generation
+                    self._data_start = data_start
+                    self._index = index
+                    self._appends = appends
+                    self._size = pos
+                    self._live = sum(_RECORD.size + len(key) + value_len
+                                     for key, (_, value_len) in index.items())
+                    self._live += sum(_RECORD.size + len(key) + value_len
+                                      for key, fragments in appends.items() for _, value_len in fragments)
+                    self._dead = pos - self._data_start - self._live
+                    self._synced_seq = self._commit_seq    # the new .log was fsynced above
+                    if self._delta is not None:
+                        self._run = None
+                        self._delta = shelf_sorted.SortedKeys(index)
+                        self._merge_sorted()
+        finally:
+            self._compactor = None
+
+    # ----------------------------------------------------------------
+    # sorted index
+    # ----------------------------------------------------------------
+
+    # The .sidx file (a shelf_sorted.SortedIndex) has the keys that existed when it was written, in order.
+    # Keys written after that are kept in self._delta, a shelf_sorted.SortedKeys that is always in order.
+    # ordered_keys() merges the two and skips keys that were deleted since. Once the delta is bigger than
+    # half of the file, both are merged into a new .sidx file, which is a single pass over the old one, so
+    # keeping the index sorted costs O(log n) per write and no sort ever happens at read time: a scan of
+    # a few keys only reads those keys from the file and from the delta.
+
+    def _load_sorted(self):
+        self._delta = shelf_sorted.SortedKeys()
+        try:
+            run = shelf_sorted.SortedIndex(self._sidxfile)
+        except (OSError, ValueError):
+            run = None     # missing, or written by an older version: make a new one
+        if run is not None:
+            if run.generation == self._generation and run.covered_end <= self._size:
+                self._run = run
+                self._delta = shelf_sorted.SortedKeys(key for key, (offset, _) in self._index.items()
+                                                      if offset >= run.covered_end)
+                return
+            run.close()
+        self._delta = shelf_sorted.SortedKeys(self._index)
+        if not self._readonly:
+            self._merge_sorted()
+
+    def _maybe_merge_sorted(self):
+        if self._delta is not None and len(self._delta) > max(4096, len(self._run or ()) // 2):
+            self._merge_sorted()
+
+    def _merge_sorted(self):
+        index = self._index
+        new_keys = self._delta.keys()
+        old_keys = self._run.keys() if self._run is not None else ()
+
+        def entries():
+            last = None
+            for key in heapq.merge(old_keys, new_keys):
+                if key != last and key in index:
+                    yield (key,) + index[key]
+                last = key
+
+        shelf_sorted.write_sorted_index(self._sidxfile, self._generation, self._size, entries(),
+                                        len(self._appends))
+        self._run = shelf_sorted.SortedIndex(self._sidxfile)
+        self._delta = shelf_sorted.SortedKeys()
+
+    def sort_index(self):
+        # Merge the keys written since the last merge into the .sidx file now
+
+        with self._lock:
+            self._check_writable()
+            if self._delta is None:
+                raise error("the database was not opened with sorted_index=True")
+            self._merge_sorted()
+
+    def ordered_keys(self, start=None, stop=None, prefix=None):
+        # Keys in sorted order, streamed from the .sidx file: all of them, the ones with
+        # start <= key < stop, or the ones beginning with prefix
+
+        if isinstance(start, str):
+            start = start.encode("utf-8")
+        if isinstance(stop, str):
+            stop = stop.encode("utf-8")
+        if isinstance(prefix, str):
+            prefix = prefix.encode("utf-8")
+        if prefix is not None and (start is None or start < prefix):
+            start = prefix
+        delta_stop = stop
+        if prefix is not None:
+            prefix_end = _prefix_end(prefix)
+            if prefix_end is not None and (stop is None or prefix_end < stop):
+                delta_stop = prefix_end
+        with self._lock:
+            self._check_open()
+            if self._delta is None:
+                raise error("the database was not opened with sorted_index=True")
+            run = self._run
+            new_keys = self._delta.keys(start, delta_stop)
+        old_keys = run.keys(start) if run is not None else ()
+
+        last = None
+        for key in heapq.merge(old_keys, new_keys):
+            if stop is not None and key >= stop:
+                return
+            if prefix is not None and not key.startswith(prefix):
+                return
+            if key != last and self._has(key):
+                yield key
+            last = key
+
+
+def _prefix_end(prefix):
+    # The first bytes string after every key that begins with prefix (None if there is none: all 0xff)
+
+    prefix = prefix.rstrip(b"\xff")
+    if not prefix:
+        return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
+
+
+_NOT_PENDING = object()
+
+
+class Transaction:
+
+    # Returned by LogDB.transaction(). Between __enter__ and __exit__ the db sends this thread's writes
+    # here (writes: key -> value, None for a delete). Leaving the block commits them, an exception rolls
+    # them back. Other threads keep seeing the committed state until then
+
+    def __init__(self, db, durable=True):
+        self.db = db
+        self.durable = durable
+        self.writes = {}
+
+    def __enter__(self):
+        local = self.db._local
+        if getattr(local, "txn", None) is not None:
+            raise error("a transaction is already active in this thread")
+        local.txn = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.db._local.txn = None
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def commit(self):
+        writes, self.writes = self.writes, {}
+        if writes:
+            self.db._commit(writes, self.durable)
+
+    def rollback(self):
+        self.writes = {}
+
+
+def _merge_lists(codec, value, fragments):
+    # LogDB.merge for the shelves: the fragments are encoded lists of items appended to a list value
+
+    value = codec.loads(value)
+    for fragment in fragments:
+        value.extend(codec.loads(fragment))
+    return codec.dumps(value)
+
+
+def _shelf_codec(db, codec, protocol):
+    # The codec a shelf file was created with is in its header. Files without one were pickled
+
+    stored = db.meta.get("codec", {"name": "pickle"})
+    if codec is None:
+        return shelf_codec.from_config(stored, protocol)
+    if codec.config() != stored:
+        db.close()
+        raise ValueError("shelf was written with codec {!r}, not {!r}".format(stored, codec.config()))
+    return codec
+
+
+class LogShelf(shelve.Shelf):
+
+    # Shelf implementation using the log-structured LogDB, the same way shelve.DbfilenameShelf uses dbm
+    # Values are pickled unless a codec (see shelf_codec.py) is given. A new file records its codec in
+    # the header, and an existing file is always read with the codec it was written with
+
+    def __init__(self, filename, flag="c", protocol=None, writeback=False, codec=None, **options):
+        meta = {"codec": codec.config()} if codec is not None else None
+        db = LogDB(filename, flag, meta=meta, **options)
+        self.codec = _shelf_codec(db, codec, protocol)
+        db.merge = functools.partial(_merge_lists, self.codec)
+        shelve.Shelf.__init__(self, db, protocol, writeback)
+        self._lists = set()      # keys we know hold a list, so append() doesn't have to check again
+
+    def __getitem__(self, key):
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        parts = self.dict.parts(key.encode(self.keyencoding))
+        value = self.codec.loads(parts[0])
+        for fragment in parts[1:]:
+            value.extend(self.codec.loads(fragment))
+        if self.writeback:
+            self.cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if self.writeback:
+            self.cache[key] = value
+        self.dict[key.encode(self.keyencoding)] = self.codec.dumps(value)
+        if type(value) is list:
+            self._lists.add(key)
+        else:
+            self._lists.discard(key)
+
+    def __delitem__(self, key):
+        shelve.Shelf.__delitem__(self, key)
+        self._lists.discard(key)
+
+    def update_value(self, key, function, *default):
+        # shelf[key] = function(shelf[key]) as one step: no other thread writes to the shelf in between.
+        # With a default, a missing key starts out as the default. Returns the new value
+
+        with self.dict._lock:
+            try:
+                value = self[key]
+            except KeyError:
+                if not default:
+                    raise
+                value = default[0]
+            value = function(value)
+            self[key] = value
+            return value
+
+    def append(self, key, item):
+        # shelf[key].append(item) that is actually saved. A missing key becomes [item]
+        self.extend(key, [item])
+
+    def extend(self, key, items):
+        # Add items to the list stored under key. Only the new items are encoded and written (one APPEND
+        # record), however long the list already is. A missing key becomes list(items)
+
+        items = list(items)
+        with self.dict._lock:
+            if key not in self._lists or self.writeback:
+                try:
+                    value = self[key]
+                except KeyError:
+                    self[key] = items
+                    return
+                if type(value) is not list:
+                    raise TypeError("can only append to a list, {!r} holds a {}".format(key, type(value).__name__))
+                if self.writeback:
+                    value.extend(items)      # the cached list, written back with the rest of the cache
+                    return
+                self._lists.add(key)
+            self.dict.append(key.encode(self.keyencoding), self.codec.dumps(items))
+
+    def compact(self, background=False):
+        self.dict.compact(background)
+
+    @contextlib.contextmanager
+    def transaction(self, durable=True):
+        # with shelf.transaction(): ... commits every assignment and del in the block together (see
+        # LogDB.transaction). A writeback cache is written into the transaction before it commits, and
+        # dropped if the block fails, so changed objects of a rolled back transaction are not saved later.
+        # The keys append() knows to hold lists are forgotten too: the rolled back writes may have made them
+
+        try:
+            with self.dict.transaction(durable):
+                yield self
+                if self.writeback:
+                    self.sync()
+        except BaseException:
+            self.cache = {}
+            self._lists = set()
+            raise
+
+    def refresh(self):
+        # Read only shelves: see what the writer process has synced since. Returns the changed keys,
+        # or None if everything was reloaded
+
+        changed = self.dict.refresh()
+        if changed is None:
+            self.cache = {}
+            return None
+        changed = [key.decode(self.keyencoding) for key in changed]
+        for key in changed:
+            self.cache.pop(key, None)
+        return changed
+
+    def ordered_keys(self, start=None, stop=None, prefix=None):
+        # Keys in alphabetical order without reading them all into a list and sorting it first.
+        # start/stop give a range (start <= key < stop), prefix only the keys starting with it.
+        # Needs the shelf to be opened with sorted_index=True
+
+        encoding = self.keyencoding
+        for key in self.dict.ordered_keys(None if start is None else start.encode(encoding),
+                                          None if stop is None else stop.encode(encoding),
+                                          None if prefix is None else prefix.encode(encoding)):
+            yield key.decode(encoding)
+
+    def ordered_items(self, start=None, stop=None, prefix=None):
+        for key in self.ordered_keys(start, stop, prefix):
+            yield key, self[key]
+
+    def keys_with_prefix(self, prefix):
+        # The keys beginning with prefix: a range of the sorted index if there is one, else all keys filtered
+
+        if self.dict._sorted_index or self.dict.lazy:
+            return self.ordered_keys(prefix=prefix)
+        return (key for key in self.keys() if key.startswith(prefix))
+
+    def sub(self, *names):
+        # Nested key path: shelf.sub("recipes")["soup"] is stored as its own record "recipes/soup"
+        # (see shelf_nested.py)
+
+        return shelf_nested.sub(self, *names)
+
+    def load(self, items, batch_size=4096):
+        # Bulk version of shelf[key] = value for a mapping or an iterable of (key, value) pairs.
+        # Values are encoded a batch at a time and handed to LogDB.load. Returns the number of pairs loaded
+
+        if hasattr(items, "items"):
+            items = items.items()
+        return self.dict.load(self._encode_items(items), batch_size)
+
+    def _encode_items(self, items):
+        for key, value in items:
+            if self.writeback:
+                self.cache[key] = value
+            yield key.encode(self.keyencoding), self.codec.dumps(value)
+
+
+class MappedShelf(shelve.Shelf):
+
+    # Read-only shelf for static data like the cave game locations.
+    # The .log file is memory-mapped, values are decoded straight from the mapped bytes, and every
+    # decoded record is kept. So the 3-5 reads of locations[loc] per turn in cave_game.py only cost
+    # a dict lookup after the first one, and many processes share the same file pages.
+
+    # NOTE: the same object is returned every time, so treat it as read only (copy it before changing it,
+    # like cave_game.py does with locations[loc]["exits"].copy())
+
+    def __init__(self, filename, keyencoding="utf-8"):
+        db = LogDB(filename, "r", use_mmap=True, lazy=True)
+        self.codec = _shelf_codec(db, None, None)
+        db.merge = functools.partial(_merge_lists, self.codec)
+        shelve.Shelf.__init__(self, db, keyencoding=keyencoding)
+        self._decoded = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._decoded[key]
+        except KeyError:
+            pass
+        with self.dict.view(key.encode(self.keyencoding)) as data:
+            value = self.codec.loads(data)
+        self._decoded[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self._decoded or key.encode(self.keyencoding) in self.dict
+
+    def refresh(self):
+        # Pick up changes another process wrote to the shelf, and forget the decoded records that changed
+
+        changed = self.dict.refresh()
+        if changed is None:
+            self._decoded = {}
+            return None
+        changed = [key.decode(self.keyencoding) for key in changed]
+        for key in changed:
+            self._decoded.pop(key, None)
+        return changed
+
+    def close(self):
+        self._decoded = {}
+        shelve.Shelf.close(self)
+
+
+def open(filename, flag="c", protocol=None, writeback=False, codec=None, **options):
+    # Drop-in replacement for shelve.open: same arguments, same Shelf object, log-structured files.
+    # codec picks the value encoding of a new shelf (default pickle, see shelf_codec.py).
+    # Extra keyword arguments (autocompact, compact_min_bytes, compact_ratio, sorted_index, lazy) are passed
+    # to LogDB
+
+    return LogShelf(filename, flag, protocol, writeback, codec, **options)
+
+
+def load(filename, items, protocol=None, batch_size=4096, codec=None, **options):
+    # Create (or replace) the shelf "filename" and fill it from a mapping or (key, value) pairs in one pass.
+    # Extra keyword arguments go to LogDB like in open(); with sorted_index=True the .sidx file is written
+    # when the load finishes, so the shelf can be opened lazily
+
+    with LogShelf(filename, "n", protocol, codec=codec, **options) as shelf:
+        return shelf.load(items, batch_size)
+
+
+def open_mapped(filename):
+    # Open a shelf_log shelf read only through MappedShelf
+
+    return MappedShelf(filename)
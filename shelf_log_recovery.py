@@ -0,0 +1,205 @@
+# =======================
+# shelf_log_recovery.py
+# =======================
+
+# Crash recovery checks for shelf_log.py
+
+# A crash can leave a shelf_log shelf in states a clean close() never does. This script makes them on
+# purpose, by writing a shelf, closing it and then cutting its files back to where a crash could have
+# stopped them, and checks what the shelf holds when it is opened again:
+#   torn_transaction      the .log lost the COMMIT record of the last transaction (or stops in the middle
+#                         of one of its records): none of the transaction's writes may be there
+#   unindexed_tail        the .log has records the .idx never got (crash between the two appends): they
+#                         are replayed from the .log, and the .idx is repaired
+#   torn_index_entry      the .idx stops in the middle of an entry: same as above
+#   transaction_index_cut the .idx stops in the middle of a committed transaction's entries: the whole
+#                         transaction is replayed from the .log
+# After every recovery a new key is written and the shelf opened once more, so a recovery that left
+# garbage at the end of a file shows up too.
+#
+#   python shelf_log_recovery.py            # prints one line per check, exits with 1 if one fails
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import shelf_log
+
+__all__ = ["CHECKS", "run"]
+
+BASE = {b"apple": b"Apple is a red crunchy fruit", b"lemon": b"Lemon is a sour yellow citrus fruit",
+        b"lime": b"Lime is a sour green citrus fruit"}
+GRAPE = b"Grapes grow in bunches"
+ORANGE = b"Orange is a sweet citrus fruit"
+
+
+class RecoveryError(AssertionError):
+    pass
+
+
+def _open(name):
+    # autocompact=False: a background compaction would replace the files this script cuts
+    return shelf_log.LogDB(name, "c", autocompact=False)
+
+
+def _write_base(name):
+    # The committed state every check starts from. Returns (.log size, .idx size) after it
+
+    db = _open(name)
+    for key, value in BASE.items():
+        db[key] = value
+    db.sync()
+    sizes = db.stats()["file_bytes"], os.path.getsize(name + ".idx")
+    db.close()
+    return sizes
+
+
+def _cut(name, log_size=None, idx_size=None):
+    # What a crash leaves behind: the files as far as they had got
+    for extension, size in ((".log", log_size), (".idx", idx_size)):
+        if size is not None:
+            with open(name + extension, "r+b") as f:
+                f.truncate(size)
+
+
+def _expect(name, expected, check):
+    # Open the shelf, compare it with expected, then write one more key and compare again after reopening
+
+    db = _open(name)
+    try:
+        found = dict(db.items())
+        if found != expected:
+            raise RecoveryError("{}: reopened shelf holds {!r}, expected {!r}".format(check, found, expected))
+        db[b"orange"] = ORANGE
+    finally:
+        db.close()
+    expected = dict(expected)
+    expected[b"orange"] = ORANGE
+    with shelf_log.LogDB(name, "r") as db:
+        found = dict(db.items())
+    if found != expected:
+        raise RecoveryError("{}: after writing to the recovered shelf it holds {!r}, expected {!r}"
+                            .format(check, found, expected))
+
+
+def torn_transaction(name):
+    _write_base(name)
+    db = _open(name)
+    with db.transaction():
+        db[b"lemon"] = b"changed"
+        db[b"grape"] = GRAPE
+        del db[b"apple"]
+    after = db.stats()["file_bytes"]
+    db.close()
+    idx_size = os.path.getsize(name + ".idx")
+
+    # The COMMIT record (no key, no value) is the last one, and so is its .idx entry. Lose both
+    _cut(name, after - shelf_log._RECORD.size, idx_size - shelf_log._ENTRY.size)
+    _expect(name, BASE, "torn_transaction (no COMMIT)")
+
+    # The same transaction again, this time the .log stops inside its first record
+    db = _open(name)
+    del db[b"orange"]
+    before = db.stats()["file_bytes"]
+    idx_before = os.path.getsize(name + ".idx")
+    with db.transaction():
+        db[b"lemon"] = b"changed"
+        db[b"grape"] = GRAPE
+    db.close()
+    _cut(name, before + 5, idx_before)
+    _expect(name, BASE, "torn_transaction (torn record)")
+
+
+def unindexed_tail(name):
+    _, idx_size = _write_base(name)
+    db = _open(name)
+    db[b"grape"] = GRAPE
+    db[b"lemon"] = b"changed"
+    del db[b"apple"]
+    with db.transaction():
+        db[b"lime"] = b"changed in a transaction"
+    db.close()
+    full_idx = os.path.getsize(name + ".idx")
+
+    _cut(name, idx_size=idx_size)
+    expected = {b"grape": GRAPE, b"lemon": b"changed", b"lime": b"changed in a transaction"}
+    db = _open(name)
+    db.close()
+    if os.path.getsize(name + ".idx") != full_idx:
+        raise RecoveryError("unindexed_tail: the .idx was not repaired ({} bytes, expected {})"
+                            .format(os.path.getsize(name + ".idx"), full_idx))
+    _expect(name, expected, "unindexed_tail")
+
+
+def torn_index_entry(name):
+    _, idx_size = _write_base(name)
+    db = _open(name)
+    db[b"grape"] = GRAPE
+    db.close()
+
+    _cut(name, idx_size=idx_size + 5)
+    expected = dict(BASE)
+    expected[b"grape"] = GRAPE
+    _expect(name, expected, "torn_index_entry")
+
+
+def transaction_index_cut(name):
+    _, idx_size = _write_base(name)
+    db = _open(name)
+    with db.transaction():
+        db[b"lemon"] = b"changed"
+        db[b"grape"] = GRAPE
+        del db[b"apple"]
+    db.close()
+
+    # Keep the first TXN_PUT entry ("lemon" was written first), lose the rest
+    _cut(name, idx_size=idx_size + shelf_log._ENTRY.size + len(b"lemon"))
+    _expect(name, {b"lemon": b"changed", b"lime": BASE[b"lime"], b"grape": GRAPE},
+            "transaction_index_cut")
+
+
+CHECKS = {
+    "torn_transaction": torn_transaction,
+    "unindexed_tail": unindexed_tail,
+    "torn_index_entry": torn_index_entry,
+    "transaction_index_cut": transaction_index_cut,
+}
+
+
+def run(checks=None):
+    # Run the checks (default: all) in a temporary directory. Returns {check: None if it passed, else the error}
+
+    results = {}
+    directory = tempfile.mkdtemp(prefix="shelf_log_recovery")
+    try:
+        for check in checks or CHECKS:
+            try:
+                CHECKS[check](os.path.join(directory, check))
+            except RecoveryError as failed:
+                results[check] = str(failed)
+            else:
+                results[check] = None
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that shelf_log shelves recover from crashes")
+    parser.add_argument("checks", nargs="*", help="default: all of " + ", ".join(CHECKS))
+    args = parser.parse_args(argv)
+    for check in args.checks:
+        if check not in CHECKS:
+            parser.error("no check called {!r}".format(check))
+
+    failed = 0
+    for check, error in run(args.checks).items():
+        print("{:<24}{}".format(check, "ok" if error is None else "FAILED: " + error))
+        failed += error is not None
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# =================
+# shelf_nested.py
+# =================
+
+# Nested key paths: a shelf inside a shelf
+
+# 24_Recipes.py keeps a whole book under one key:
+#   books["recipes"] = {"blt": [...], "beans_on_toast": [...], "soup": [...], ...}
+#   print(books["recipes"]["soup"])
+# Reading books["recipes"]["soup"] unpickles every recipe just to hand out one of them, and changing one
+# recipe means reading, changing and writing back the whole dict (the temp_list dance).
+
+# A Namespace stores every leaf as its own record under a composite key, the names joined with "/":
+#   books.sub("recipes")["soup"] = ["tin of soup"]       # stored as books["recipes/soup"]
+#   print(books.sub("recipes")["soup"])                   # reads (and unpickles) only that record
+# So reading or writing one nested item costs as much as that item, whatever the size of the rest.
+
+# A Namespace is a normal mapping (get, items, update, del, in, len, ...) of the leaves directly in it,
+# and can have namespaces of its own: books.sub("recipes").sub("breakfast")["eggs"].
+# Listing a namespace walks the keys beginning with its path; on a shelf_log shelf opened with
+# sorted_index=True that is a prefix scan of the sorted index, otherwise all keys are looked at.
+
+#   import shelve, shelf_nested
+#   with shelve.open("book") as books:
+#       recipes = shelf_nested.sub(books, "recipes")
+#       recipes.update({"blt": ["bacon", "lettuce", "tomato", "bread"], "soup": ["tin of soup"]})
+#       print(recipes["soup"])
+#   with shelf_log.open("book") as books:
+#       print(books.sub("recipes")["soup"])
+
+from collections.abc import MutableMapping
+
+__all__ = ["SEPARATOR", "Namespace", "sub"]
+
+SEPARATOR = "/"
+
+
+def _check_name(name):
+    if not isinstance(name, str):
+        raise TypeError("names in a key path must be strings, not {}".format(type(name).__name__))
+    if not name or SEPARATOR in name:
+        raise ValueError("{!r} is not a valid name in a key path".format(name))
+
+
+class Namespace(MutableMapping):
+
+    def __init__(self, shelf, path):
+        for name in path:
+            _check_name(name)
+        self.shelf = shelf
+        self.path = tuple(path)
+        self._prefix = SEPARATOR.join(self.path) + SEPARATOR
+
+    def __repr__(self):
+        return "<Namespace {!r} of {!r}>".format(SEPARATOR.join(self.path), self.shelf)
+
+    def _key(self, key):
+        _check_name(key)
+        return self._prefix + key
+
+    def sub(self, name):
+        # The namespace "name" inside this one
+        return Namespace(self.shelf, self.path + (name,))
+
+    def __getitem__(self, key):
+        return self.shelf[self._key(key)]
+
+    def __setitem__(self, key, value):
+        self.shelf[self._key(key)] = value
+
+    def __delitem__(self, key):
+        del self.shelf[self._key(key)]
+
+    def __contains__(self, key):
+        try:
+            return self._key(key) in self.shelf
+        except (TypeError, ValueError):
+            return False
+
+    def _paths(self):
+        # Everything below this namespace, as paths relative to it ("soup", "breakfast/eggs", ...)
+
+        start = len(self._prefix)
+        keys_with_prefix = getattr(self.shelf, "keys_with_prefix", None)
+        if keys_with_prefix is not None:
+            keys = keys_with_prefix(self._prefix)
+        else:
+            keys = (key for key in self.shelf.keys() if key.startswith(self._prefix))
+        for key in keys:
+            yield key[start:]
+
+    def __iter__(self):
+        for path in self._paths():
+            if SEPARATOR not in path:
+                yield path
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def namespaces(self):
+        # Names of the namespaces directly inside this one
+
+        seen = set()
+        for path in self._paths():
+            name, separator, _ = path.partition(SEPARATOR)
+            if separator and name not in seen:
+                seen.add(name)
+                yield name
+
+
+def sub(shelf, *names):
+    # The namespace names[0]/names[1]/... of any shelf (or other mapping with string keys)
+
+    if not names:
+        raise ValueError("sub() needs at least one name")
+    return Namespace(shelf, names)
@@ -0,0 +1,69 @@
+# ===============
+# shelf_scan.py
+# ===============
+
+# Read a whole shelf front to back instead of key by key
+
+# Loops like these from 24_Shelve.py and 24_Recipes.py
+#   for i in fruit.items(): ...
+#   for snack in recipes: print(snack, recipes[snack])
+# look up every key on its own, so each value is a separate seek + read somewhere in the .dat file.
+# On a big shelf that means the disk spends its time seeking instead of reading.
+
+# items() and values() below walk the data file in the order the values are stored in it, with
+# large buffered reads, and hand out the unpickled pairs one at a time from a generator:
+#   - shelf_log shelves: LogDB.scan() reads the .log file from start to end
+#   - dbm.dumb shelves (shelve.open in this project): the .dir index is sorted by position and the
+#     .dat file is read in that order
+#   - any other dbm: falls back to the normal shelf.items()
+# The pairs don't come in key order (use ordered_items in shelf_log for that).
+
+#   import shelve, shelf_scan
+#   with shelve.open("ShelfTest") as fruit:
+#       for key, description in shelf_scan.items(fruit):
+#           print(key, description)
+
+import io
+import pickle
+
+__all__ = ["items", "values"]
+
+BUFFER_SIZE = 1 << 20
+
+
+def _scan_dumb(db, buffer_size):
+    # dbm.dumb keeps key -> (position, size) in db._index and the values in db._datfile
+
+    db._verify_open()
+    entries = sorted(db._index.items(), key=lambda item: item[1][0])
+    with io.open(db._datfile, "rb", buffering=buffer_size) as f:
+        for key, (pos, size) in entries:
+            f.seek(pos)      # moving forward inside the buffer doesn't touch the disk
+            yield key, f.read(size)
+
+
+def items(shelf, buffer_size=BUFFER_SIZE):
+    # (key, value) pairs of the shelf in data file order
+
+    db = shelf.dict
+    if hasattr(db, "scan"):
+        pairs = db.scan(buffer_size)
+    elif hasattr(db, "_index") and hasattr(db, "_datfile"):
+        pairs = _scan_dumb(db, buffer_size)
+    else:
+        yield from shelf.items()
+        return
+
+    loads = shelf.codec.loads if hasattr(shelf, "codec") else pickle.loads
+    cache = shelf.cache if shelf.writeback else {}
+    for key, data in pairs:
+        key = key.decode(shelf.keyencoding)
+        if key in cache:
+            yield key, cache[key]          # writeback shelf: the cached (maybe changed) value
+        else:
+            yield key, loads(data)
+
+
+def values(shelf, buffer_size=BUFFER_SIZE):
+    for _, value in items(shelf, buffer_size):
+        yield value
@@ -0,0 +1,214 @@
+# ================
+# shelf_shard.py
+# ================
+
+# One shelf spread over several files
+
+# A shelf is one set of files: every write goes to the same file one after the other, and reading the
+# whole shelf (loading it, scanning it) is one long pass over one file by one process.
+
+# ShardedShelf looks like a single shelf (shelf[key], del, in, len, keys, items, ...) but stores it as N
+# shelf_log shelves, <name>.000 ... <name>.<N-1>. Every key always goes to the same shard: the crc32 of
+# the UTF-8 key modulo N (not hash(), which changes every time Python starts). N is kept in <name>.shards.
+
+# Because the shards are independent files, the work on a whole shelf can be split between them:
+#   load()        fills the shards at the same time in a pool of processes (one shard per task)
+#   map_shards()  runs a function over the items of every shard in a pool of processes and returns
+#                 the results, one per shard (counting, searching, building summaries, ...)
+# so a big catalog uses all cores, and all disks if the shard files are spread over them.
+
+#   import shelf_shard
+#   shelf_shard.load("catalog", items, shards=8)                # parallel bulk load
+#   with shelf_shard.open("catalog") as catalog:
+#       print(catalog["some key"])
+#       counts = catalog.map_shards(shelf_shard.count)          # [items in shard 0, in shard 1, ...]
+#       print(sum(counts))
+
+import io
+import json
+import multiprocessing
+import zlib
+from collections.abc import MutableMapping
+
+import shelf_log
+import shelf_scan
+
+__all__ = ["ShardedShelf", "open", "load", "count"]
+
+DEFAULT_SHARDS = 8
+
+
+def _shard_name(filename, number):
+    return "{}.{:03d}".format(filename, number)
+
+
+def _read_shard_count(filename):
+    try:
+        with io.open(filename + ".shards", encoding="utf-8") as f:
+            return json.load(f)["shards"]
+    except FileNotFoundError:
+        return None
+
+
+def _write_shard_count(filename, shards):
+    with io.open(filename + ".shards", "w", encoding="utf-8") as f:
+        json.dump({"shards": shards, "hash": "crc32"}, f)
+
+
+def _shard_count(filename, flag, shards):
+    # The number of shards of an existing sharded shelf, or of the new one we are about to create
+
+    existing = _read_shard_count(filename) if flag != "n" else None
+    if existing is None:
+        if flag in ("r", "w"):
+            raise shelf_log.error("need 'c' or 'n' flag to open new db")
+        existing = shards or DEFAULT_SHARDS
+        _write_shard_count(filename, existing)
+    elif shards is not None and shards != existing:
+        raise ValueError("{!r} has {} shards, not {}".format(filename, existing, shards))
+    return existing
+
+
+class ShardedShelf(MutableMapping):
+
+    # flag, protocol, writeback, codec and **options work like shelf_log.open and are used for every shard
+
+    def __init__(self, filename, flag="c", shards=None, protocol=None, writeback=False, codec=None, **options):
+        self.filename = filename
+        self._names = [_shard_name(filename, number) for number in range(_shard_count(filename, flag, shards))]
+        self.shards = []
+        try:
+            for name in self._names:
+                self.shards.append(shelf_log.open(name, flag, protocol, writeback, codec, **options))
+        except BaseException:
+            self.close()
+            raise
+
+    def shard(self, key):
+        # The shard shelf that holds key
+        return self.shards[zlib.crc32(key.encode("utf-8")) % len(self.shards)]
+
+    def __getitem__(self, key):
+        return self.shard(key)[key]
+
+    def __setitem__(self, key, value):
+        self.shard(key)[key] = value
+
+    def __delitem__(self, key):
+        del self.shard(key)[key]
+
+    def __contains__(self, key):
+        return key in self.shard(key)
+
+    def __iter__(self):
+        for shard in self.shards:
+            yield from shard
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def items(self):
+        # Every (key, value) pair, each shard read front to back (see shelf_scan.py)
+
+        for shard in self.shards:
+            yield from shelf_scan.items(shard)
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def sync(self):
+        for shard in self.shards:
+            shard.sync()
+
+    def close(self):
+        shards, self.shards = self.shards, []
+        for shard in shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def load(self, items, batch_size=4096):
+        # Bulk load into the open shards (in this process). Returns the number of pairs loaded
+
+        if hasattr(items, "items"):
+            items = items.items()
+        parts = _partition(items, len(self.shards))
+        return sum(shard.load(part, batch_size) for shard, part in zip(self.shards, parts))
+
+    def map_shards(self, function, processes=None):
+        # function(iterator of (key, value) pairs of one shard) in a pool of worker processes, one task per
+        # shard. Returns the results in shard order. function must be picklable (defined at module level).
+        # The workers open the shards read only and see what was written up to now. processes=1 runs
+        # everything in this process
+
+        self.sync()
+        return _map(_scan_shard, [(name, function) for name in self._names], processes)
+
+
+def _partition(items, shards):
+    parts = [[] for _ in range(shards)]
+    for key, value in items:
+        parts[zlib.crc32(key.encode("utf-8")) % shards].append((key, value))
+    return parts
+
+
+def _map(function, tasks, processes):
+    if processes == 1:
+        return [function(task) for task in tasks]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(function, tasks, chunksize=1)
+
+
+def _scan_shard(args):
+    name, function = args
+    with shelf_log.open(name, "r") as shard:
+        return function(shelf_scan.items(shard))
+
+
+# load() leaves the partitioned pairs here for forked workers, which get a copy of this process's
+# memory for free, instead of pickling every pair over to them
+
+_parts = None
+
+
+def _load_shard(args):
+    name, number, items, protocol, codec, batch_size = args
+    if items is None:
+        items = _parts[number]
+    return shelf_log.load(name, items, protocol, batch_size, codec)
+
+
+def count(items):
+    # A map_shards function: the number of items in a shard
+    return sum(1 for _ in items)
+
+
+def open(filename, flag="c", shards=None, protocol=None, writeback=False, codec=None, **options):
+    # Like shelf_log.open, for a sharded shelf. shards is only needed to create one (default 8)
+
+    return ShardedShelf(filename, flag, shards, protocol, writeback, codec, **options)
+
+
+def load(filename, items, shards=DEFAULT_SHARDS, protocol=None, batch_size=4096, codec=None, processes=None):
+    # Create (or replace) the sharded shelf "filename" from a mapping or (key, value) pairs.
+    # The pairs are split by shard here, then every shard is encoded and written by its own worker process.
+    # Returns the number of pairs loaded
+
+    if hasattr(items, "items"):
+        items = items.items()
+    global _parts
+    _write_shard_count(filename, shards)
+    parts = _partition(items, shards)
+    inherit = processes != 1 and multiprocessing.get_start_method() == "fork"
+    tasks = [(_shard_name(filename, number), number, None if inherit else part, protocol, codec, batch_size)
+             for number, part in enumerate(parts)]
+    _parts = parts if inherit else None
+    try:
+        return sum(_map(_load_shard, tasks, processes))
+    finally:
+        _parts = None
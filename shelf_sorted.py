@@ -0,0 +1,183 @@
+# =================
+# shelf_sorted.py
+# =================
+
+# A sorted key index file for shelf_log shelves (<name>.sidx)
+
+# 24_Shelve.py prints the fruit in alphabetical order like this:
+#   ordered_keys = list(fruit.keys())
+#   ordered_keys.sort()
+# That reads every key into a list and sorts it before the first one can be printed.
+
+# A .sidx file holds every key of the shelf already in sorted order (byte order of the UTF-8 keys,
+# which is the same as the order of the strings), together with where its value is in the .log file:
+
+#   header   magic, generation of the .log it belongs to, number of keys, .log size it covers,
+#            position of the offset table, number of keys that had appended fragments (not in this file)
+#   entries  key length, .log record offset, value length, key bytes     (sorted by key)
+#   table    one 8 byte offset per entry, so entry i can be found without reading entries 0..i-1
+
+# The file is memory-mapped, so finding the first key >= "g" is a binary search over the table
+# and walking forward from there reads the keys in order, one at a time.
+# LogDB(sorted_index=True) keeps the file up to date, and LogDB(lazy=True) uses it instead of reading
+# the .idx file when it opens a shelf (see shelf_log.py).
+
+# The keys written since the file was made are kept in memory in a SortedKeys: a list of short sorted
+# lists. Adding a key is a binary search and an insert into one short list, and a range of keys is found
+# with a binary search too, so neither has to sort (or even look at) all the new keys.
+
+import bisect
+import io
+import mmap
+import os
+import struct
+from array import array
+
+__all__ = ["SortedIndex", "SortedKeys", "write_sorted_index"]
+
+SIDX_MAGIC = b"SHLFSRT2"
+_HEADER = struct.Struct("<8sQQQQQ")
+_ENTRY = struct.Struct("<IQI")
+_OFFSET = struct.Struct("<Q")
+
+
+def write_sorted_index(filename, generation, covered_end, entries, appended=0):
+    # entries: (key, record offset, value length) in key order. Written to a temporary file which then
+    # replaces "filename", so readers never see a half written index.
+    # appended: how many of the keys had APPEND fragments, which the file doesn't say where they are
+
+    tmp = filename + ".tmp"
+    offsets = array("Q")
+    with io.open(tmp, "wb") as f:
+        f.write(_HEADER.pack(SIDX_MAGIC, generation, 0, covered_end, 0, appended))
+        pos = _HEADER.size
+        for key, offset, value_len in entries:
+            offsets.append(pos)
+            f.write(_ENTRY.pack(len(key), offset, value_len))
+            f.write(key)
+            pos += _ENTRY.size + len(key)
+        f.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+        f.seek(0)
+        f.write(_HEADER.pack(SIDX_MAGIC, generation, len(offsets), covered_end, pos, appended))
+    os.replace(tmp, filename)
+
+
+class SortedIndex:
+
+    def __init__(self, filename):
+        with io.open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(SIDX_MAGIC)] != SIDX_MAGIC or len(self._map) < _HEADER.size:
+            self._map.close()
+            raise ValueError("{!r} is not a sorted shelf index (or an older version)".format(filename))
+        _, self.generation, self._count, self.covered_end, self._table, self.appended = \
+            _HEADER.unpack_from(self._map, 0)
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._map.close()
+
+    def entry(self, i):
+        # (key, record offset, value length) of the i-th key
+
+        pos = _OFFSET.unpack_from(self._map, self._table + 8 * i)[0]
+        key_len, offset, value_len = _ENTRY.unpack_from(self._map, pos)
+        start = pos + _ENTRY.size
+        return self._map[start:start + key_len], offset, value_len
+
+    def key(self, i):
+        pos = _OFFSET.unpack_from(self._map, self._table + 8 * i)[0]
+        key_len = _ENTRY.unpack_from(self._map, pos)[0]
+        start = pos + _ENTRY.size
+        return self._map[start:start + key_len]
+
+    def bisect_left(self, key):
+        # Position of the first key >= key
+
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, key):
+        # (record offset, value length) for key, or None if the key is not in this index
+
+        i = self.bisect_left(key)
+        if i < self._count:
+            found, offset, value_len = self.entry(i)
+            if found == key:
+                return offset, value_len
+        return None
+
+    def keys(self, start=None):
+        # Keys in order, beginning with the first key >= start
+
+        i = 0 if start is None else self.bisect_left(start)
+        while i < self._count:
+            yield self.key(i)
+            i += 1
+
+
+class SortedKeys:
+
+    # A sorted set of keys: short sorted lists (split once they pass 2 * LOAD keys), and the last key
+    # of each, to find the list a key belongs in
+
+    LOAD = 1000
+
+    def __init__(self, keys=()):
+        keys = sorted(set(keys))
+        self._lists = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self._maxes = [part[-1] for part in self._lists]
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, key):
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return False
+        part = self._lists[i]
+        return part[bisect.bisect_left(part, key)] == key
+
+    def add(self, key):
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            return
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+        part = self._lists[i]
+        j = bisect.bisect_left(part, key)
+        if j < len(part) and part[j] == key:
+            return
+        part.insert(j, key)
+        self._maxes[i] = part[-1]
+        self._len += 1
+        if len(part) > 2 * self.LOAD:
+            self._lists[i:i + 1] = [part[:self.LOAD], part[self.LOAD:]]
+            self._maxes[i:i + 1] = [part[self.LOAD - 1], part[-1]]
+
+    def keys(self, start=None, stop=None):
+        # The keys with start <= key < stop (either may be None), in order, as a new list
+
+        i = 0 if start is None else bisect.bisect_left(self._maxes, start)
+        found = []
+        while i < len(self._lists):
+            part = self._lists[i]
+            low = 0 if start is None else bisect.bisect_left(part, start)
+            if stop is not None and part[-1] >= stop:
+                found.extend(part[low:bisect.bisect_left(part, stop)])
+                break
+            found.extend(part[low:])
+            i += 1
+        return found
@@ -0,0 +1,244 @@
+# ================
+# shelf_stats.py
+# ================
+
+# Where does the time of a shelf go?
+
+# A shelf operation is a few different costs added together: reading or writing the file (I/O), pickling
+# or unpickling the value, and for sync()/close() writing out the index (dbm.dumb rewrites the whole .dir
+# file). Timing the whole program doesn't tell which of them to work on.
+
+# InstrumentedShelf is a shelf that measures itself. For every kind of operation
+#   get, contains, set, delete, iterate, sync, close
+# it counts the calls and keeps a latency histogram (powers of two microseconds), and for the whole shelf
+# it adds up the bytes read and written, the time spent in the dbm (I/O), encoding and decoding, and
+# how often a writeback cache answered a get. Turning it on is choosing this class instead of shelve.open;
+# a plain shelf pays nothing.
+
+#   import shelf_stats
+#   with shelf_stats.open("ShelfTest") as fruit:
+#       for key in fruit:
+#           print(key, fruit[key])
+#       print(fruit.stats.report())               # plain text table
+#       fruit.stats.dump("ShelfTest.stats.json")  # everything as JSON
+#
+# Any dbm-like mapping works, e.g. shelf_stats.InstrumentedShelf(shelf_log.LogDB("locations", "r")).
+# cave_engine.py --stats does the same with shelf_frozen.FrozenDB("locations") to measure the cave game's turns.
+
+import dbm
+import io
+import json
+import pickle
+import shelve
+import time
+
+import shelf_codec
+
+__all__ = ["Histogram", "ShelfStats", "InstrumentedShelf", "open"]
+
+OPERATIONS = ("get", "contains", "set", "delete", "iterate", "sync", "close")
+
+
+class Histogram:
+
+    # Bucket i holds the latencies below 2**i microseconds (and not below 2**(i-1))
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0      # seconds
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        # Upper bound (microseconds) of the bucket the percentile falls in, or the largest latency seen
+        # if that is smaller (the last bucket's bound can be almost twice it)
+
+        if not self.count:
+            return 0
+        wanted = self.count * percent / 100.0
+        seen = 0
+        bucket = self.BUCKETS - 1
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                break
+        return min(1 << bucket, self.max * 1e6)
+
+    def to_dict(self):
+        return {"count": self.count, "total_us": self.total * 1e6,
+                "mean_us": self.total * 1e6 / self.count if self.count else 0.0,
+                "max_us": self.max * 1e6,
+                "p50_us": self.percentile(50), "p90_us": self.percentile(90), "p99_us": self.percentile(99),
+                "buckets_us": {str(1 << bucket): count for bucket, count in enumerate(self.counts) if count}}
+
+
+class ShelfStats:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.operations = {operation: Histogram() for operation in OPERATIONS}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.io_seconds = 0.0          # inside the dbm: reads, writes, sync and close of the files
+        self.encode_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.cache_hits = 0            # gets answered by the writeback cache
+        self.cache_misses = 0
+
+    def to_dict(self):
+        gets = self.cache_hits + self.cache_misses
+        return {"operations": {name: histogram.to_dict() for name, histogram in self.operations.items()},
+                "bytes_read": self.bytes_read, "bytes_written": self.bytes_written,
+                "io_us": self.io_seconds * 1e6, "encode_us": self.encode_seconds * 1e6,
+                "decode_us": self.decode_seconds * 1e6,
+                "cache_hits": self.cache_hits, "cache_misses": self.cache_misses,
+                "cache_hit_rate": self.cache_hits / gets if gets else 0.0}
+
+    def dump(self, filename):
+        with io.open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+    def report(self):
+        lines = ["{:<10}{:>10}{:>12}{:>10}{:>10}{:>10}".format("operation", "calls", "mean us", "p50 us",
+                                                              "p99 us", "max us")]
+        for name, histogram in self.operations.items():
+            if histogram.count:
+                stats = histogram.to_dict()
+                lines.append("{:<10}{count:>10}{mean_us:>12.1f}{p50_us:>10.0f}{p99_us:>10.0f}{max_us:>10.0f}"
+                             .format(name, **stats))
+        stats = self.to_dict()
+        lines.append("io {io_us:.0f} us, encode {encode_us:.0f} us, decode {decode_us:.0f} us, "
+                     "read {bytes_read} bytes, written {bytes_written} bytes, "
+                     "cache hit rate {cache_hit_rate:.1%}".format(**stats))
+        return "\n".join(lines)
+
+
+class InstrumentedShelf(shelve.Shelf):
+
+    # codec: a shelf_codec codec for files written with one (default pickle, like shelve). A shelf_log
+    # LogDB that records its codec in its header is read with that one
+
+    def __init__(self, dict, protocol=None, writeback=False, keyencoding="utf-8", codec=None):
+        shelve.Shelf.__init__(self, dict, protocol, writeback, keyencoding)
+        self.stats = ShelfStats()
+        self._closed = False
+        if codec is None and "codec" in getattr(dict, "meta", {}):
+            codec = shelf_codec.from_config(dict.meta["codec"], protocol)
+        if codec is not None:
+            self._dumps, self._loads = codec.dumps, codec.loads
+        else:
+            self._dumps = lambda value: pickle.dumps(value, self._protocol)
+            self._loads = pickle.loads
+
+    def __getitem__(self, key):
+        stats = self.stats
+        start = time.perf_counter()
+        try:
+            value = self.cache[key]
+        except KeyError:
+            stats.cache_misses += 1
+            data = self.dict[key.encode(self.keyencoding)]
+            read = time.perf_counter()
+            value = self._loads(data)
+            decoded = time.perf_counter()
+            stats.io_seconds += read - start
+            stats.decode_seconds += decoded - read
+            stats.bytes_read += len(data)
+            if self.writeback:
+                self.cache[key] = value
+        else:
+            stats.cache_hits += 1
+        stats.operations["get"].add(time.perf_counter() - start)
+        return value
+
+    def __contains__(self, key):
+        start = time.perf_counter()
+        found = key in self.cache or key.encode(self.keyencoding) in self.dict
+        seconds = time.perf_counter() - start
+        self.stats.io_seconds += seconds
+        self.stats.operations["contains"].add(seconds)
+        return found
+
+    def __setitem__(self, key, value):
+        stats = self.stats
+        start = time.perf_counter()
+        if self.writeback:
+            self.cache[key] = value
+        data = self._dumps(value)
+        encoded = time.perf_counter()
+        self.dict[key.encode(self.keyencoding)] = data
+        end = time.perf_counter()
+        stats.encode_seconds += encoded - start
+        stats.io_seconds += end - encoded
+        stats.bytes_written += len(data)
+        stats.operations["set"].add(end - start)
+
+    def __delitem__(self, key):
+        start = time.perf_counter()
+        shelve.Shelf.__delitem__(self, key)
+        seconds = time.perf_counter() - start
+        self.stats.io_seconds += seconds
+        self.stats.operations["delete"].add(seconds)
+
+    def __iter__(self):
+        # Times getting the keys from the dbm, not the loop that uses them
+
+        start = time.perf_counter()
+        keys = [key.decode(self.keyencoding) for key in self.dict.keys()]
+        seconds = time.perf_counter() - start
+        self.stats.io_seconds += seconds
+        self.stats.operations["iterate"].add(seconds)
+        return iter(keys)
+
+    def sync(self):
+        # The writeback entries sync() stores are counted as sets as well
+
+        start = time.perf_counter()
+        if self.writeback and self.cache:
+            self.writeback = False
+            try:
+                for key, entry in self.cache.items():
+                    self[key] = entry
+            finally:
+                self.writeback = True
+            self.cache = {}
+        if hasattr(self.dict, "sync"):
+            io_start = time.perf_counter()
+            self.dict.sync()
+            self.stats.io_seconds += time.perf_counter() - io_start
+        self.stats.operations["sync"].add(time.perf_counter() - start)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        start = time.perf_counter()
+        try:
+            self.sync()
+            io_start = time.perf_counter()
+            try:
+                self.dict.close()     # dbm.dumb writes its whole .dir file here
+            except AttributeError:
+                pass
+            self.stats.io_seconds += time.perf_counter() - io_start
+        finally:
+            self.dict = shelve._ClosedDict()
+        self.stats.operations["close"].add(time.perf_counter() - start)
+
+
+def open(filename, flag="c", protocol=None, writeback=False):
+    # Same as shelve.open (same dbm files), with self.stats filled in as it is used
+
+    return InstrumentedShelf(dbm.open(filename, flag), protocol, writeback)
@@ -0,0 +1,101 @@
+# ====================
+# shelf_writeback.py
+# ====================
+
+# writeback=True that only writes back the entries that actually changed
+
+# 24_Recipes.py uses shelve.open(..., writeback=True) for recipes4 and recipes5.
+# With writeback, shelve keeps every value it hands out in a cache, and sync() (and close(), which
+# calls sync) pickles and writes EVERY cached entry back to the file, even the ones we only read.
+# On a shelf that is mostly read, almost all of that writing is wasted.
+
+# DirtyTrackingShelf works the same way as writeback=True from the outside:
+#   recipes["soup"].append("croutons")   # still saved on sync()/close()
+# but it remembers a hash of every value (pickled with our protocol) when it is read or written.
+# On sync() each cached value is pickled again and only written if its hash changed.
+# So reading 10,000 recipes and changing one of them writes one record, not 10,000.
+
+# Like shelve, sync() empties the cache, so the recipes5 example in 24_Recipes.py behaves the same.
+
+# Usage:
+#
+#   import shelf_writeback
+#   with shelf_writeback.open("recipes4") as recipes4:
+#       recipes4["soup"].append("croutons")
+#       recipes4.sync()
+#       print(recipes4.written, recipes4.skipped)   # 1 written, the rest skipped
+
+import dbm
+import hashlib
+import shelve
+from io import BytesIO
+from pickle import Pickler, Unpickler
+
+__all__ = ["DirtyTrackingShelf", "open"]
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class DirtyTrackingShelf(shelve.Shelf):
+
+    def __init__(self, dict, protocol=None, keyencoding="utf-8"):
+        shelve.Shelf.__init__(self, dict, protocol, True, keyencoding)
+        self._digests = {}   # key -> hash of the value pickled as it was read or written
+        self.written = 0     # entries written back by sync()
+        self.skipped = 0     # cached entries sync() found unchanged
+
+    def _dumps(self, value):
+        f = BytesIO()
+        Pickler(f, self._protocol).dump(value)
+        return f.getvalue()
+
+    def __getitem__(self, key):
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        data = self.dict[key.encode(self.keyencoding)]
+        value = Unpickler(BytesIO(data)).load()
+        self.cache[key] = value
+        # hash it the way sync() will pickle it: the file may have been written with another protocol
+        self._digests[key] = _digest(self._dumps(value))
+        return value
+
+    def __setitem__(self, key, value):
+        data = self._dumps(value)
+        self.cache[key] = value
+        self.dict[key.encode(self.keyencoding)] = data
+        self._digests[key] = _digest(data)
+
+    def __delitem__(self, key):
+        del self.dict[key.encode(self.keyencoding)]
+        self.cache.pop(key, None)
+        self._digests.pop(key, None)
+
+    def dirty_keys(self):
+        # Keys of cached values that changed since they were read or assigned (pickles each cached value)
+
+        return [key for key, value in self.cache.items()
+                if _digest(self._dumps(value)) != self._digests.get(key)]
+
+    def sync(self):
+        if self.cache:
+            for key, value in self.cache.items():
+                data = self._dumps(value)
+                if _digest(data) != self._digests.get(key):
+                    self.dict[key.encode(self.keyencoding)] = data
+                    self.written += 1
+                else:
+                    self.skipped += 1
+            self.cache = {}
+            self._digests = {}
+        if hasattr(self.dict, "sync"):
+            self.dict.sync()
+
+
+def open(filename, flag="c", protocol=None):
+    # Same as shelve.open(filename, flag, protocol, writeback=True), with dirty tracking
+
+    return DirtyTrackingShelf(dbm.open(filename, flag), protocol)